@@ -0,0 +1,74 @@
+"""
+Startup benchmark of the command line interface.
+
+Runs `python -m ptrack.cli --help` in fresh interpreters and reports how long it
+takes, together with the slowest imports as reported by `python -X importtime`.
+
+    python -m benchmarks.bench_import
+    python -m benchmarks.bench_import --runs 50 --top 20
+
+The exit status is 1 if starting the CLI imports any of the carrier dependencies,
+those should only be loaded once a package of their carrier shows up.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+COMMAND = [sys.executable, '-m', 'ptrack.cli', '--help']
+
+# only needed once packages are actually looked up
+HEAVY_MODULES = ('requests', 'urllib3', 'bs4', 'lxml', 'dateutil')
+
+
+def wall_times(runs: int) -> List[float]:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(COMMAND, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def import_times() -> List[Tuple[str, int]]:
+    """
+    (module, cumulative import time in us) of every module imported at startup
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', *COMMAND[1:]], check=True,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        modules.append((name.strip(), int(cumulative)))
+    return modules
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20, help="number of interpreters to start")
+    parser.add_argument('--top', type=int, default=10, help="number of slowest imports to show")
+    args = parser.parse_args(argv)
+
+    times = wall_times(args.runs)
+    print('{} --help: median {:.1f} ms, min {:.1f} ms over {} runs\n'.format(
+        ' '.join(COMMAND[1:3]), statistics.median(times) * 1000, min(times) * 1000, args.runs
+    ))
+
+    modules = import_times()
+    print('{:<40} {:>12}'.format('module', 'cumulative ms'))
+    for name, cumulative in sorted(modules, key=lambda m: -m[1])[:args.top]:
+        print('{:<40} {:>12.1f}'.format(name, cumulative / 1000))
+
+    heavy = sorted({name for name, _ in modules if name.split('.')[0] in HEAVY_MODULES})
+    if heavy:
+        print('\nimported at startup: {}'.format(', '.join(heavy)), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
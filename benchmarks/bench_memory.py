@@ -0,0 +1,124 @@
+"""
+Memory benchmark of the tracking state models.
+
+Builds the states of a watcher holding many packages, once with the models in
+ptrack.modules.models and once with plain dataclasses laid out the way the models
+used to be (a __dict__ per instance, update histories as lists, no interning), and
+reports the memory held by each.
+
+    python -m benchmarks.bench_memory
+    python -m benchmarks.bench_memory --packages 100000 --updates 20
+
+The exit status is 1 if the current models don't use less memory than the legacy layout.
+"""
+import argparse
+import random
+import sys
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from ptrack.modules.models import PackageState, TrackingIdentifier, TrackingState, TrackingUpdateItem
+
+from .make_fixtures import CITIES, TEXTS
+
+
+@dataclass(frozen=True, unsafe_hash=True)
+class LegacyIdentifier:
+    number: str
+    source: Optional[str] = None
+    readable_name: Optional[str] = None
+
+
+@dataclass
+class LegacyUpdateItem:
+    text: str
+    when: datetime
+    where: Optional[str]
+
+
+@dataclass(frozen=True)
+class LegacyState:
+    id: LegacyIdentifier
+    state: PackageState
+    short_description: str
+    additional_info: str
+    last_update: datetime
+    progress: Tuple[int, int]
+    is_delivered: bool
+    is_retoure: Optional[bool]
+    is_express: Optional[bool]
+    updates: List[LegacyUpdateItem]
+
+
+MODELS = {
+    'legacy': (LegacyIdentifier, LegacyUpdateItem, LegacyState),
+    'current': (TrackingIdentifier, TrackingUpdateItem, TrackingState),
+}
+
+
+def _fresh(text: str) -> str:
+    # parsers hand us a new string object for every occurrence, even if the text repeats
+    return ''.join(list(text))
+
+
+def build(models, packages: int, updates: int) -> dict:
+    identifier, update_item, state = models
+    rnd = random.Random(packages)
+    places = [', '.join(filter(None, [city[0], city[2]])) for city in CITIES]
+    start = datetime(2022, 7, 1, 8, 0, 0)
+
+    tracks = dict()
+    for i in range(packages):
+        id = identifier('{:020d}'.format(i), 'dhl', 'package {}'.format(i))
+        history = [
+            update_item(
+                text=_fresh(rnd.choice(TEXTS)),
+                when=start + timedelta(hours=j),
+                where=_fresh(rnd.choice(places)),
+            ) for j in range(updates)
+        ]
+        tracks[id] = state(
+            id=id,
+            state=PackageState.ON_THE_WAY,
+            short_description=_fresh(history[-1].text),
+            additional_info=_fresh(history[-1].text),
+            last_update=history[-1].when,
+            progress=(2, 5),
+            is_delivered=False,
+            is_retoure=False,
+            is_express=False,
+            updates=history,
+        )
+    return tracks
+
+
+def measure(models, packages: int, updates: int) -> int:
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    tracks = build(models, packages, updates)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tracks
+    return after - before
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--packages', type=int, default=100000, help="number of packages to hold")
+    parser.add_argument('--updates', type=int, default=10, help="updates per package")
+    args = parser.parse_args(argv)
+
+    results = dict()
+    print('{:<10} {:>12} {:>16}'.format('models', 'MiB', 'bytes/package'))
+    for name, models in MODELS.items():
+        results[name] = size = measure(models, args.packages, args.updates)
+        print('{:<10} {:>12.1f} {:>16.0f}'.format(name, size / 2**20, size / args.packages))
+
+    print('\n{:.0%} less memory'.format(1 - results['current'] / results['legacy']))
+    return 0 if results['current'] < results['legacy'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
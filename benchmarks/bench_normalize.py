@@ -0,0 +1,102 @@
+"""
+Microbenchmark of the date and location normalization.
+
+Parses the timestamps and locations of a long tracking history once per poll,
+the way the carriers see them, with the per-carrier code ptrack used to have
+and with ptrack.modules.normalize, and reports the cost per event.
+
+    python -m benchmarks.bench_normalize
+    python -m benchmarks.bench_normalize --events 2000 --polls 50
+"""
+import argparse
+import datetime
+import random
+import re
+import sys
+import time
+from typing import Callable, List
+
+from dateutil.parser import parse as dateutil_parse
+
+from ptrack.modules.normalize import clear_caches, location, parse_datetime
+from .make_fixtures import CITIES
+
+
+_GLS_FORMATS = (
+    (re.compile(r'\d{1,2}\.\d{1,2}\.\d{4} \d{1,2}:\d{2}:\d{2}'), '%d.%m.%Y %H:%M:%S'),
+    (re.compile(r'\d{1,2}\.\d{1,2}\.\d{4} \d{1,2}:\d{2}'), '%d.%m.%Y %H:%M'),
+)
+
+
+def _legacy_gls(text: str) -> datetime.datetime:
+    for pattern, fmt in _GLS_FORMATS:
+        if pattern.fullmatch(text):
+            return datetime.datetime.strptime(text, fmt)
+    return dateutil_parse(text, dayfirst=True)
+
+
+def _legacy_globalpost(dtstring: str) -> datetime.datetime:
+    date, time = dtstring.split(' - ', 1)
+    date = datetime.datetime.strptime(date.strip().lower(), '%b %d, %Y').date()
+    return datetime.datetime.combine(date, datetime.datetime.strptime(time.strip().upper(), '%I:%M %p').time())
+
+
+def _legacy_location(city, province, country):
+    return ", ".join(filter(lambda x: x, [city, province, country])) or None
+
+
+def _history(events: int) -> List[datetime.datetime]:
+    rnd = random.Random(events)
+    when = datetime.datetime(2022, 7, 1, 8, 0)
+    history = []
+    for _ in range(events):
+        when += datetime.timedelta(minutes=rnd.randint(5, 600))
+        history.append(when)
+    return history
+
+
+def measure(items: list, polls: int, normalize: Callable) -> float:
+    """
+    nanoseconds per item, the caches start out empty
+    """
+    clear_caches()
+    start = time.perf_counter()
+    for _ in range(polls):
+        for item in items:
+            normalize(item)
+    return (time.perf_counter() - start) / (polls * len(items)) * 1e9
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, default=500, help="length of the tracking history")
+    parser.add_argument('--polls', type=int, default=20, help="how often the history is parsed")
+    args = parser.parse_args(argv)
+
+    history = _history(args.events)
+    rnd = random.Random(0)
+    gls = ['{:%d.%m.%Y %H:%M:%S}'.format(when) for when in history]
+    places = [rnd.choice(CITIES)[:3] for _ in range(args.events)]
+    cases = [
+        # name, inputs, old code, new code
+        ('iso (dhl, asendia)', [when.isoformat() + '+02:00' for when in history],
+         datetime.datetime.fromisoformat, parse_datetime),
+        ('gls table (lxml)', gls, _legacy_gls, lambda text: parse_datetime(text, dayfirst=True)),
+        ('gls table (bs4)', gls, lambda text: dateutil_parse(text, dayfirst=True),
+         lambda text: parse_datetime(text, dayfirst=True)),
+        ('globalpost', ['{:%b %d, %Y - %I:%M %p}'.format(when) for when in history],
+         _legacy_globalpost, parse_datetime),
+        ('location', places, lambda parts: _legacy_location(*parts), lambda parts: location(*parts)),
+    ]
+
+    print('{} events, parsed {} times'.format(args.events, args.polls))
+    print('{:<24} {:>12} {:>12} {:>8}'.format('case', 'old ns/ev', 'new ns/ev', 'speedup'))
+    for name, items, old, new in cases:
+        old_ns = measure(items, args.polls, old)
+        new_ns = measure(items, args.polls, new)
+        print('{:<24} {:>12.0f} {:>12.0f} {:>7.1f}x'.format(name, old_ns, new_ns, old_ns / new_ns))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
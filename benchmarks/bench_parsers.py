@@ -0,0 +1,191 @@
+"""
+Offline benchmark of the carrier response parsers.
+
+Every supplier's parse path is run against the generated fixtures in
+benchmarks/fixtures (small, large with 100+ events, and malformed). For each
+case it reports parse throughput, the memory still held by the result and the
+peak memory while parsing, and compares them against benchmarks/baseline.json.
+
+    python -m benchmarks.bench_parsers                  # compare against the baseline
+    python -m benchmarks.bench_parsers --save-baseline  # record a new baseline
+
+Throughput depends on the machine, so record a baseline on the machine you compare on.
+The exit status is 1 if any case regressed by more than --tolerance, or if the fast
+GLS parser disagrees with the reference one.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from ptrack.modules.asendia import AsendiaTracking, AsendiaConfig
+from ptrack.modules.dhl_de import _cut_json_string_from_response, _match_sendungen, _info_from_json_obj
+from ptrack.modules.globalpost import GlobalPostTracking, GlobalPostSettings, _MARKERS
+from ptrack.modules.gls import GLS, GLS_Config
+from ptrack.modules.helpers import find_substring
+from ptrack.modules.models import TrackingIdentifier
+
+from .make_fixtures import FIXTURES, NUMBERS
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+VARIANTS = ('small', 'large', 'malformed')
+
+
+def _id(carrier: str) -> TrackingIdentifier:
+    return TrackingIdentifier(NUMBERS[carrier], carrier)
+
+
+def parse_dhl(raw: str):
+    id = _id('dhl')
+    data = json.loads(_cut_json_string_from_response(raw))
+    return _info_from_json_obj(_match_sendungen(data, [id])[id], id)
+
+
+def parse_asendia(raw: str):
+    return AsendiaTracking(AsendiaConfig())._create_tracking_result_from_json(json.loads(raw), _id('asendia'))
+
+
+def parse_gls(raw: str):
+    return _parse_gls(raw, GLS(GLS_Config())._parse_gls_response_html_fast)
+
+
+def parse_gls_bs4(raw: str):
+    return _parse_gls(raw, GLS(GLS_Config())._parse_gls_response_html)
+
+
+def _parse_gls(raw: str, parser):
+    id = _id('gls')
+    return parser(json.loads(raw)['content'][id.number]['html'], id)
+
+
+def parse_globalpost(raw: str):
+    parts = [find_substring(raw, start, end) for start, end in _MARKERS]
+    return GlobalPostTracking(GlobalPostSettings())._state_from_parts(parts, _id('globalpost'))
+
+
+PARSERS: Dict[str, Tuple[str, Callable]] = {
+    'dhl': ('dhl', parse_dhl),
+    'asendia': ('asendia', parse_asendia),
+    'gls': ('gls', parse_gls),
+    'gls-bs4': ('gls', parse_gls_bs4),
+    'globalpost': ('globalpost', parse_globalpost),
+}
+
+
+def load_fixture(carrier: str, variant: str) -> str:
+    directory = os.path.join(FIXTURES, carrier)
+    name = next(name for name in os.listdir(directory) if name.startswith(variant + '.'))
+    with open(os.path.join(directory, name)) as f:
+        return f.read()
+
+
+def _call(parser: Callable, raw: str):
+    # malformed responses are expected to fail, what matters is how fast they do
+    try:
+        return parser(raw)
+    except Exception:
+        return None
+
+
+def measure(parser: Callable, raw: str, min_time: float) -> dict:
+    _call(parser, raw)
+
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        _call(parser, raw)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    result = _call(parser, raw)
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    return {
+        'packages_per_s': runs / elapsed,
+        'retained_kib': (after - before) / 1024,
+        'peak_kib': (peak - before) / 1024,
+    }
+
+
+def check_equivalence() -> List[str]:
+    """
+    the fast GLS parser has to agree with the reference implementation
+    """
+    return [
+        'gls/{}: lxml and bs4 parsers disagree'.format(variant)
+        for variant in VARIANTS
+        if _call(parse_gls, load_fixture('gls', variant)) != _call(parse_gls_bs4, load_fixture('gls', variant))
+    ]
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    regressions = []
+    for case, result in results.items():
+        base = baseline.get(case)
+        if base is None:
+            continue
+        if result['packages_per_s'] < base['packages_per_s'] * (1 - tolerance):
+            regressions.append('{}: {:.0f} packages/s, baseline {:.0f}'.format(
+                case, result['packages_per_s'], base['packages_per_s']
+            ))
+        # allow a little slack, small cases only allocate a few KiB
+        if result['peak_kib'] > base['peak_kib'] * (1 + tolerance) + 4:
+            regressions.append('{}: peak {:.1f} KiB, baseline {:.1f} KiB'.format(
+                case, result['peak_kib'], base['peak_kib']
+            ))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--min-time', type=float, default=0.5, help="seconds to run each case for")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('-k', '--filter', default='', help="only run cases containing this string")
+    args = parser.parse_args(argv)
+    # malformed cases log their errors on every run
+    logging.disable(logging.CRITICAL)
+
+    results = dict()
+    print('{:<24} {:>14} {:>14} {:>12}'.format('case', 'packages/s', 'retained KiB', 'peak KiB'))
+    for name, (carrier, parse) in PARSERS.items():
+        for variant in VARIANTS:
+            case = '{}/{}'.format(name, variant)
+            if args.filter not in case:
+                continue
+            results[case] = result = measure(parse, load_fixture(carrier, variant), args.min_time)
+            print('{:<24} {:>14.0f} {:>14.1f} {:>12.1f}'.format(
+                case, result['packages_per_s'], result['retained_kib'], result['peak_kib']
+            ))
+
+    if args.save_baseline:
+        with open(BASELINE, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('\nbaseline written to {}'.format(BASELINE))
+        return 0
+
+    problems = check_equivalence()
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            problems += compare(results, json.load(f), args.tolerance)
+    else:
+        print('\nno baseline to compare against, run with --save-baseline first')
+
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
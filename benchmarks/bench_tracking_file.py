@@ -0,0 +1,87 @@
+"""
+Benchmark of reading large tracking files.
+
+Writes tracking files with --lines packages in every supported format to a
+temporary directory and reports how fast they are read, once from scratch and
+once more with the line cache of the first read, like a reload of an unchanged
+file. The plain format is also read with the regex based parser ptrack used to
+have, for comparison.
+
+    python -m benchmarks.bench_tracking_file
+    python -m benchmarks.bench_tracking_file --lines 100000
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from typing import Callable, Dict
+
+from ptrack.cli.trackfile import read_tracking_file
+from ptrack.modules.models import TrackingIdentifier
+from ptrack.modules.registry import BUILTIN_CARRIERS
+
+SOURCES = list(BUILTIN_CARRIERS)
+
+
+def _legacy_split(line: str):
+    return [x[0].strip('"') for x in re.findall(r'("(\\"|[^"\\])+"|[^\s]+)', line)]
+
+
+def _legacy_read(path: str):
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            number, *info = _legacy_split(line)
+            yield TrackingIdentifier(number, source=info[0], readable_name=info[1] if len(info) > 1 else None)
+
+
+def _package(i: int):
+    # every third package has a name with spaces, which needs quoting in the plain format
+    return '{:020d}'.format(i), SOURCES[i % len(SOURCES)], 'order {} for shop'.format(i) if i % 3 == 0 else None
+
+
+def write_files(directory: str, lines: int) -> Dict[str, str]:
+    paths = {
+        'lines': os.path.join(directory, 'tracking.txt'),
+        'csv': os.path.join(directory, 'tracking.csv'),
+        'jsonl': os.path.join(directory, 'tracking.jsonl'),
+    }
+    with open(paths['lines'], 'w') as plain, open(paths['csv'], 'w') as csv, open(paths['jsonl'], 'w') as jsonl:
+        csv.write('number,carrier,name\n')
+        for i in range(lines):
+            number, source, name = _package(i)
+            plain.write('{} {}{}\n'.format(number, source, ' "{}"'.format(name) if name else ''))
+            csv.write('{},{},{}\n'.format(number, source, name or ''))
+            jsonl.write(json.dumps({'number': number, 'source': source, 'name': name}) + '\n')
+    return paths
+
+
+def measure(read: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    count = sum(1 for _ in read())
+    elapsed = time.perf_counter() - start
+    return count / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lines', type=int, default=1000000, help="packages per file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_files(directory, args.lines)
+        print('{:<24} {:>14}'.format('case', 'lines/s'))
+        print('{:<24} {:>14.0f}'.format('lines/legacy', measure(lambda: _legacy_read(paths['lines']))))
+        for format, path in paths.items():
+            cache = dict()
+            print('{:<24} {:>14.0f}'.format(format + '/cold', measure(lambda: read_tracking_file(path, SOURCES, cache))))
+            print('{:<24} {:>14.0f}'.format(format + '/cached', measure(lambda: read_tracking_file(path, SOURCES, cache))))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+(Re)generate the carrier fixtures used by the benchmarks.
+
+The fixtures follow the structure of real carrier responses, with all personal
+data (tracking numbers, names, addresses, free text) replaced by placeholders.
+They are deterministic, so regenerating them does not invalidate the baseline.
+
+    python -m benchmarks.make_fixtures
+"""
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+NUMBERS = {
+    'dhl': '00340434000000000001',
+    'asendia': 'AS000000000001',
+    'gls': '00000000001',
+    'globalpost': 'GP000000000001',
+}
+
+CITIES = [
+    ('Berlin', None, 'DE', 'Germany'),
+    ('Leipzig', 'Sachsen', 'DE', 'Germany'),
+    ('Bochum', 'Nordrhein-Westfalen', 'DE', 'Germany'),
+    ('Amsterdam', None, 'NL', 'Netherlands'),
+    ('Jamaica', 'NY', 'US', 'United States'),
+    (None, None, 'US', 'United States'),
+]
+
+TEXTS = [
+    'The shipment has been processed in the parcel center',
+    'The shipment has been loaded onto the delivery vehicle',
+    'The shipment has arrived at the destination country',
+    'Customs clearance completed',
+    'The shipment has been handed over to the carrier',
+]
+
+
+def _events(rnd: random.Random, count: int):
+    when = datetime(2022, 7, 1, 8, 0, 0)
+    for _ in range(count):
+        when += timedelta(minutes=rnd.randint(10, 600))
+        yield when, rnd.choice(CITIES), rnd.choice(TEXTS)
+
+
+def dhl_page(events: int) -> str:
+    rnd = random.Random(events)
+    items = [
+        {'datum': when.isoformat() + '+02:00', 'ort': city[0] or '', 'status': text}
+        for when, city, text in _events(rnd, events)
+    ]
+    data = {'sendungen': [{
+        'id': NUMBERS['dhl'],
+        'sendungsinfo': {'sendungsnummer': NUMBERS['dhl'], 'sendungsname': 'Sendung "Placeholder"'},
+        'sendungsdetails': {
+            'istZugestellt': False,
+            'retoure': False,
+            'expressSendung': False,
+            'zustellung': {'zugestelltAnEmpfaenger': False, 'benachrichtigtInFiliale': False},
+            'sendungsverlauf': {
+                'kurzStatus': 'Die Sendung wird zugestellt',
+                'aktuellerStatus': 'Die Sendung wurde in das Zustellfahrzeug geladen.',
+                'datumAktuellerStatus': items[-1]['datum'] if items else '2022-07-01T08:00:00+02:00',
+                'fortschritt': 4,
+                'maximalFortschritt': 5,
+                'events': items,
+            },
+        },
+    }]}
+    return _dhl_html(json.dumps(json.dumps(data)))
+
+
+def _dhl_html(js_literal: str) -> str:
+    return (
+        '<!DOCTYPE html><html lang="de"><head><title>DHL Sendungsverfolgung</title>'
+        + '<link rel="stylesheet" href="/int-verfolgen/static/main.css">' * 40
+        + '</head><body><div id="root"></div><script>window.__INITIAL_APP_STATE__ = {'
+        + 'initialState: JSON.parse(' + js_literal + '), '
+        + 'config: {"locale": "de"}};</script>'
+        + '<script src="/int-verfolgen/static/bundle.js"></script>' * 40
+        + '</body></html>'
+    )
+
+
+def asendia_json(events: int) -> str:
+    rnd = random.Random(events)
+    return json.dumps({
+        'trackingBrandedSummary': {
+            'trackingNumberVendor': NUMBERS['asendia'],
+            'trackingProgress': {'completed': 2, 'total': 5},
+        },
+        'trackingBrandedDetail': [
+            {
+                'eventDescription': text,
+                'eventOn': when.isoformat(),
+                'eventLocationDetails': {
+                    'city': city[0], 'province': city[1], 'countryIso2': city[2], 'countryName': city[3],
+                },
+            } for when, city, text in reversed(list(_events(rnd, events)))
+        ],
+    })
+
+
+def gls_json(events: int, with_table: bool = True) -> str:
+    rnd = random.Random(events)
+    rows = ''.join(
+        '<tr><td>{:%d.%m.%Y}</td><td>{:%H:%M:%S}</td><td>{}</td><td>{}</td></tr>'.format(
+            when, when, text, ', '.join(filter(None, [city[0], city[3]]))
+        ) for when, city, text in reversed(list(_events(rnd, events)))
+    )
+    html = (
+        '<div class="container pt-20px"><div class="row"><div class="col-12">'
+        '<p class="lead">Status: <strong>Das Paket wird zugestellt</strong></p>'
+        '<p class="lead">Voraussichtliche Zustellung: <strong>Mo, 08.08.2022</strong></p>'
+        '</div></div></div>'
+        '<div class="ce_icon_box_container">'
+        + '<div class="ce_icon_box status--complete"><span class="icon"></span></div>' * 3
+        + '<div class="ce_icon_box status--current"><span class="icon"></span></div>'
+        + '<div class="ce_icon_box"><span class="icon"></span></div>'
+        + '</div>'
+    )
+    if with_table:
+        html += (
+            '<table class="data_table table"><thead><tr><th>Datum</th><th>Uhrzeit</th>'
+            '<th>Status</th><th>Ort</th></tr></thead><tbody>' + rows + '</tbody></table>'
+        )
+    return json.dumps({'content': {NUMBERS['gls']: {'html': html}}})
+
+
+def globalpost_page(events: int, with_data: bool = True) -> str:
+    rnd = random.Random(events)
+    history = list(_events(rnd, events))
+    rows = ''.join(
+        '<div class="track-event"><span class="date">{:%b %d, %Y - %I:%M %p}</span>'
+        '<span class="desc">{}</span><span class="loc">{}</span></div>'.format(when, text, city[0] or '')
+        for when, city, text in reversed(history)
+    )
+    (first_when, first_city, first_text), (last_when, last_city, last_text) = history[0], history[-1]
+    data = {
+        'lastEventDesc': last_text,
+        'lastEventDate': '{:%b %d, %Y - %I:%M %p}'.format(last_when),
+        'lastEventCity': last_city[0], 'lastEventState': last_city[1], 'lastEventCountry': last_city[2],
+        'firstEventDesc': first_text,
+        'firstEventDate': '{:%b %d, %Y - %I:%M %p}'.format(first_when),
+        'firstEventCity': first_city[0], 'firstEventState': first_city[1], 'firstEventCountry': first_city[2],
+    }
+    return (
+        '<html><head><title>Track Detail</title></head><body>'
+        '<div class="sidebar-right"><span class="sidebar-right-ele text-normal"> In transit to destination '
+        '</span></div>'
+        + rows
+        + ('<script>var trackingData = ' + json.dumps(data) + ';\n</script>' if with_data else '')
+        + '</body></html>'
+    )
+
+
+def generate():
+    fixtures = {
+        'dhl': {
+            'small.html': dhl_page(5),
+            'large.html': dhl_page(150),
+            # the embedded state is cut off in the middle
+            'malformed.html': _dhl_html('"{\\"sendungen\\": [{\\"id\\": \\"' + NUMBERS['dhl'] + '\\", \\"sendungsdetails'),
+        },
+        'asendia': {
+            'small.json': asendia_json(5),
+            'large.json': asendia_json(150),
+            # no tracking progress in the summary
+            'malformed.json': json.dumps({'trackingBrandedSummary': {}, 'trackingBrandedDetail': []}),
+        },
+        'gls': {
+            'small.json': gls_json(5),
+            'large.json': gls_json(150),
+            'malformed.json': gls_json(5, with_table=False),
+        },
+        'globalpost': {
+            'small.html': globalpost_page(5),
+            'large.html': globalpost_page(150),
+            'malformed.html': globalpost_page(5, with_data=False),
+        },
+    }
+    for carrier, files in fixtures.items():
+        os.makedirs(os.path.join(FIXTURES, carrier), exist_ok=True)
+        for name, content in files.items():
+            with open(os.path.join(FIXTURES, carrier, name), 'w') as f:
+                f.write(content)
+
+
+if __name__ == '__main__':
+    generate()
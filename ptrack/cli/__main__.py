@@ -1,6 +1,17 @@
-import time
+import json
+import logging
+import os
+from functools import partial
+from typing import Callable, Optional, Union
 
+from .events import render_events
+from .daemon import Daemon, DaemonClient, DaemonError, default_socket_path, request_stats
+from .profile import TickProfiler
+from .store import StateStore, default_store_path
 from .watch import PackageWatcher
+from ptrack.modules.archive import ResponseArchive, configure_archive, default_archive_path
+from ptrack.modules.metrics import METRICS, Histogram, prometheus_text
+from ptrack.modules.transport import TransportConfig, configure_shared_transport
 import click
 
 file_arg = click.argument(
@@ -9,29 +20,345 @@ file_arg = click.argument(
 )
 
 
+def network_options(f):
+    f = click.option(
+        '--deadline', default=0.5, type=float, show_default=True,
+        help="seconds to wait for lookups before showing what is known, the rest is shown as it arrives"
+    )(f)
+    f = click.option(
+        '--shards', default=0, type=int,
+        help="look up and parse packages in this many worker processes, for very large tracking files"
+    )(f)
+    f = click.option(
+        '--retries', default=TransportConfig.retries, type=int,
+        help="how often to retry failed requests"
+    )(f)
+    f = click.option(
+        '--timeout', default=TransportConfig.timeout, type=float,
+        help="seconds to wait for a carrier to respond"
+    )(f)
+    f = click.option(
+        '-j', '--max-concurrency', default=64, type=int,
+        help="maximum number of lookups in flight at once"
+    )(f)
+    f = click.option(
+        '-r', '--rate-limit', multiple=True, metavar='CARRIER=N',
+        help="maximum number of lookups per second at a single carrier (default 10), can be given multiple times"
+    )(f)
+    f = click.option(
+        '-c', '--carrier-concurrency', multiple=True, metavar='CARRIER=N',
+        help="maximum number of lookups in flight for a single carrier, can be given multiple times"
+    )(f)
+    return f
+
+
+archive_dir_option = click.option(
+    '--archive-dir', default=default_archive_path, show_default="~/.cache/ptrack/archive",
+    type=click.Path(file_okay=False),
+    help="where carrier responses are archived"
+)
+
+
+def state_options(f):
+    f = archive_dir_option(f)
+    f = click.option(
+        '--archive', is_flag=True,
+        help="keep every distinct carrier response, compressed, so 'ptrack reparse' can parse them again"
+    )(f)
+    f = click.option(
+        '--no-state', is_flag=True,
+        help="don't persist package states between runs"
+    )(f)
+    f = click.option(
+        '--state-file', default=default_store_path, show_default="~/.cache/ptrack/state.sqlite3",
+        type=click.Path(dir_okay=False),
+        help="where to persist package states between runs"
+    )(f)
+    return f
+
+
+def socket_options(f):
+    f = click.option(
+        '--no-daemon', is_flag=True,
+        help="always poll the carriers from this process, even if a daemon is running"
+    )(f)
+    f = click.option(
+        '--socket', 'socket_path', type=click.Path(dir_okay=False),
+        help="socket of the daemon to display, derived from the tracking file by default"
+    )(f)
+    return f
+
+
+def debug_options(f):
+    f = click.option(
+        '--profile-output', default='ptrack.prof', show_default=True, type=click.Path(dir_okay=False),
+        help="where to write the --profile output"
+    )(f)
+    f = click.option(
+        '--profile', default=0, type=int, metavar='N',
+        help="profile the first N ticks with cProfile"
+    )(f)
+    f = click.option(
+        '--metrics-file', type=click.Path(dir_okay=False),
+        help="write metrics in the Prometheus text format to this file after every tick"
+    )(f)
+    return f
+
+
+def _parse_carrier_limits(values, param_hint: str, type: Callable = int) -> dict:
+    limits = dict()
+    for value in values:
+        carrier, _, limit = value.partition('=')
+        try:
+            limits[carrier] = type(limit)
+        except ValueError:
+            raise click.BadParameter("expected CARRIER=N, got {!r}".format(value), param_hint=param_hint)
+    return limits
+
+
+def _make_watcher(file: str, display_mode: str, max_concurrency: int, carrier_concurrency, rate_limit,
+                  timeout: float, retries: int, shards: int, deadline: float, state_file: str, no_state: bool,
+                  archive: bool, archive_dir: str, poll_interval: float = 1) -> PackageWatcher:
+    carrier_concurrency = _parse_carrier_limits(carrier_concurrency, '--carrier-concurrency')
+    rate_limits = _parse_carrier_limits(rate_limit, '--rate-limit', float)
+    configure_shared_transport(TransportConfig(
+        timeout=timeout,
+        retries=retries,
+        pool_size=max([TransportConfig.pool_size, *carrier_concurrency.values()])
+    ))
+    if archive:
+        configure_archive(archive_dir)
+    store = StateStore(state_file) if not no_state else None
+    return PackageWatcher(file, display_mode, max_concurrency, carrier_concurrency, store,
+                          poll_interval=poll_interval, rate_limits=rate_limits, shards=shards, deadline=deadline)
+
+
+def _connect(file: str, display_mode: str, socket_path: str, no_daemon: bool) -> Optional[DaemonClient]:
+    """
+    connect to the daemon watching file, if there is one
+    """
+    if no_daemon:
+        return None
+    try:
+        return DaemonClient(socket_path or default_socket_path(file), display_mode)
+    except OSError:
+        return None
+
+
+def _attach_profiler(task: Union[PackageWatcher, DaemonClient, Daemon], profiler: TickProfiler):
+    # lookups run on the refresh engines worker threads, those need their own profiles
+    watcher = task.watcher if isinstance(task, Daemon) else task
+    if isinstance(watcher, PackageWatcher):
+        watcher.engine.thread_initializer = profiler.thread_initializer
+
+
+def _run(task: Union[PackageWatcher, DaemonClient, Daemon], fallback: Optional[Callable[[], PackageWatcher]],
+         metrics_file: Optional[str] = None, profile: int = 0, profile_output: str = 'ptrack.prof'):
+    """
+    print the output of task whenever it changes. If task is a daemon client and
+    the daemon goes away, continue with a local watcher from fallback.
+    """
+    profiler = TickProfiler(profile, profile_output)
+    _attach_profiler(task, profiler)
+    while True:
+        with profiler.tick():
+            output = task.tick()
+        if output is not None:
+            print(output, flush=True)
+        if metrics_file:
+            METRICS.write_prometheus(metrics_file)
+        try:
+            task.wait()
+        except ConnectionError:
+            if fallback is None:
+                raise
+            logging.getLogger(__name__).warning("Lost the daemon, polling from this process")
+            renderer = task.renderer
+            task = fallback()
+            # the output continues, e.g. the i3bar-json header must not be sent again
+            task.renderer = renderer
+            _attach_profiler(task, profiler)
+
+
+def _setup_logging():
+    logging.root.setLevel(logging.DEBUG)
+    logging.disable(logging.NOTSET)
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('[%(asctime)s %(levelname)-8s] %(name)-12s: %(message)s'))
+    logging.getLogger('ptrack').addHandler(handler)
+
+
 @click.group('ptrack')
 def ptrack():
-    pass
+    _setup_logging()
 
 
 @ptrack.command('i3bar')
 @file_arg
-def i3_display(file: str):
-    task = PackageWatcher(file, 'i3bar')
-    while True:
-        print(task.tick())
-        time.sleep(1)
+@click.option('--json', 'json_protocol', is_flag=True, help="speak the i3bar/swaybar JSON protocol, one block per package")
+@socket_options
+@network_options
+@state_options
+@debug_options
+def i3_display(file: str, json_protocol: bool, socket_path: str, no_daemon: bool,
+               metrics_file: str, profile: int, profile_output: str, **options):
+    display_mode = 'i3bar-json' if json_protocol else 'i3bar'
+    fallback = partial(_make_watcher, file, display_mode, **options)
+    _run(_connect(file, display_mode, socket_path, no_daemon) or fallback(), fallback,
+         metrics_file, profile, profile_output)
 
 
 @ptrack.command('view')
 @file_arg
 @click.option('-m', '--viewmode', help="in what format to display the info", default="compact")
-@click.option('-n', '--refresh', help="the rate at which to refresh", default=1)
-def view(file: str, viewmode: str, refresh: int):
-    task = PackageWatcher(file, viewmode)
-    while True:
-        task.tick()
-        time.sleep(int(refresh))
+@click.option('-n', '--refresh', help="how often to check the file for changes where inotify is unavailable", default=1)
+@socket_options
+@network_options
+@state_options
+@debug_options
+def view(file: str, viewmode: str, refresh: int, socket_path: str, no_daemon: bool,
+         metrics_file: str, profile: int, profile_output: str, **options):
+    fallback = partial(_make_watcher, file, viewmode, poll_interval=refresh, **options)
+    _run(_connect(file, viewmode, socket_path, no_daemon) or fallback(), fallback,
+         metrics_file, profile, profile_output)
+
+
+@ptrack.command('events')
+@file_arg
+@click.option('--initial', is_flag=True, help="start with an 'added' event for every package")
+@socket_options
+@network_options
+@state_options
+@debug_options
+def events(file: str, initial: bool, socket_path: str, no_daemon: bool,
+           metrics_file: str, profile: int, profile_output: str, **options):
+    """
+    print what changes about the packages in FILE as JSON Lines
+    """
+    fallback = partial(_make_watcher, file, 'events', **options)
+    task = _connect(file, 'events', socket_path, no_daemon) or fallback()
+    if initial and task.tracks:
+        print(render_events({}, task.tracks), flush=True)
+    _run(task, fallback, metrics_file, profile, profile_output)
+
+
+@ptrack.command('daemon')
+@file_arg
+@click.option('--socket', 'socket_path', type=click.Path(dir_okay=False),
+              help="where to listen, derived from the tracking file by default")
+@click.option('-n', '--refresh', help="how often to check the file for changes where inotify is unavailable", default=1)
+@network_options
+@state_options
+@debug_options
+def daemon(file: str, socket_path: str, refresh: int, metrics_file: str, profile: int, profile_output: str,
+           **options):
+    """
+    poll the packages in FILE and serve their states to view and i3bar
+    """
+    task = Daemon(_make_watcher(file, 'compact', poll_interval=refresh, **options),
+                  socket_path or default_socket_path(file))
+    try:
+        task.start()
+    except DaemonError as e:
+        raise click.ClickException(str(e))
+    try:
+        _run(task, None, metrics_file, profile, profile_output)
+    finally:
+        task.close()
+
+
+def _format_seconds(value: Optional[float]) -> str:
+    return '{:.1f}ms'.format(value * 1000) if value is not None else '-'
+
+
+def _format_labels(labels: dict) -> str:
+    return ','.join('{}={}'.format(key, value) for key, value in sorted(labels.items()))
+
+
+@ptrack.command('stats')
+@file_arg
+@click.option('--socket', 'socket_path', type=click.Path(dir_okay=False),
+              help="socket of the daemon to ask, derived from the tracking file by default")
+@click.option('--prometheus', is_flag=True, help="print the metrics in the Prometheus text format")
+def stats(file: str, socket_path: str, prometheus: bool):
+    """
+    show lookup, parse and tick metrics of the daemon watching FILE
+    """
+    try:
+        metrics = request_stats(socket_path or default_socket_path(file))
+    except OSError:
+        raise click.ClickException("no daemon is running for {}, start one with 'ptrack daemon'".format(file))
+
+    if prometheus:
+        click.echo(prometheus_text(metrics), nl=False)
+        return
+
+    click.echo('{:<32} {:<32} {:>10}'.format('counter', 'labels', 'value'))
+    for name, series in sorted(metrics['counters'].items()):
+        for entry in sorted(series, key=lambda entry: _format_labels(entry['labels'])):
+            click.echo('{:<32} {:<32} {:>10.0f}'.format(name, _format_labels(entry['labels']), entry['value']))
+
+    click.echo('\n{:<32} {:<32} {:>8} {:>10} {:>10} {:>10}'.format('histogram', 'labels', 'count', 'mean', 'p50', 'p95'))
+    for name, series in sorted(metrics['histograms'].items()):
+        for entry in sorted(series, key=lambda entry: _format_labels(entry['labels'])):
+            histogram = Histogram.from_dict(entry)
+            click.echo('{:<32} {:<32} {:>8} {:>10} {:>10} {:>10}'.format(
+                name, _format_labels(entry['labels']), histogram.count,
+                _format_seconds(histogram.sum / histogram.count if histogram.count else None),
+                _format_seconds(histogram.quantile(0.5)),
+                _format_seconds(histogram.quantile(0.95)),
+            ))
+
+
+@ptrack.command('reparse')
+@archive_dir_option
+@click.option('--carrier', 'carriers', multiple=True, help="only parse the responses of this carrier, can be given multiple times")
+@click.option('-p', '--processes', type=int, default=None, help="number of worker processes, one per core by default")
+@click.option('-o', '--output', type=click.File('w'), help="write the rebuilt states to this file as JSON Lines")
+def reparse(archive_dir: str, carriers: tuple, processes: Optional[int], output):
+    """
+    parse the archived carrier responses again with the current parsers, without network access
+    """
+    if not os.path.isdir(archive_dir):
+        raise click.ClickException("there is no archive in {}, record one with --archive".format(archive_dir))
+    archive = ResponseArchive(archive_dir)
+    # imported here so the other commands don't pull in multiprocessing
+    from .reparse import reparse as reparse_archive
+
+    # carrier -> responses, packages, found, errors, bytes, seconds
+    totals = dict()
+    for result in reparse_archive(archive, carriers, processes):
+        found = sum(1 for state in result.states.values() if state is not None)
+        counts = totals.setdefault(result.entry.carrier, [0, 0, 0, 0, 0, 0])
+        for i, value in enumerate((1, len(result.entry.ids), found, result.error is not None, result.size, result.seconds)):
+            counts[i] += value
+        if result.error is not None:
+            logging.getLogger(__name__).error("Could not parse {} from {}: {}".format(
+                result.entry.key, result.entry.carrier, result.error
+            ))
+        if output is not None:
+            output.write(json.dumps({
+                'carrier': result.entry.carrier,
+                'key': result.entry.key,
+                'digest': result.entry.digest,
+                'first_seen': result.entry.first_seen,
+                'error': result.error,
+                'states': [
+                    {'package': id.to_dict(), 'state': state.to_dict() if state is not None else None}
+                    for id, state in result.states.items()
+                ],
+            }, ensure_ascii=False) + '\n')
+    archive.close()
+
+    click.echo('{:<16} {:>10} {:>10} {:>10} {:>8} {:>10} {:>10}'.format(
+        'carrier', 'responses', 'packages', 'found', 'errors', 'parse', 'MB/s'
+    ))
+    for carrier, (responses, packages, found, errors, size, seconds) in sorted(totals.items()):
+        click.echo('{:<16} {:>10} {:>10} {:>10} {:>8} {:>10} {:>10}'.format(
+            carrier, responses, packages, found, errors, _format_seconds(seconds / responses),
+            '{:.1f}'.format(size / seconds / 1e6) if seconds else '-'
+        ))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,372 @@
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+from collections import deque
+from logging import getLogger
+from typing import Deque, List, Optional, Set
+
+from ptrack.modules.metrics import METRICS
+from ptrack.modules.models import TrackingIdentifier, TrackingState
+from .render import Marks, Renderer, Tracks
+from .watch import PackageWatcher
+
+logger = getLogger(__name__)
+
+# The protocol is newline delimited JSON. A client sends one request line,
+# {"command": "snapshot"} or {"command": "subscribe"}, and the daemon answers with
+#
+#   {"type": "snapshot", "file": ..., "tracks": [{"id": {...}, "state": {...} or null}, ...]}
+#
+# For subscribe, that first snapshot is followed by a message every time a state changes:
+#
+#   {"type": "update", "changed": [{"id": {...}, "state": {...} or null}, ...]}
+#
+# A new snapshot is sent instead if packages were added, removed or renamed, so the
+# order of the tracks always matches the tracking file.
+#
+# {"command": "stats"} is answered with {"type": "stats", "metrics": ...}, the
+# daemons Metrics.to_dict().
+
+
+def default_socket_path(file: str) -> str:
+    """
+    the socket of the daemon watching file, one per file and user
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    digest = hashlib.blake2b(os.path.abspath(file).encode(), digest_size=8).hexdigest()
+    return os.path.join(runtime_dir, 'ptrack-{}-{}.sock'.format(os.getuid(), digest))
+
+
+def _entry(id: TrackingIdentifier, state: Optional[TrackingState], mark: Optional[str] = None) -> dict:
+    entry = {'id': id.to_dict(), 'state': state.to_dict() if state is not None else None}
+    if mark is not None:
+        entry['mark'] = mark
+    return entry
+
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message, ensure_ascii=False).encode() + b'\n'
+
+
+def decode_tracks(entries: List[dict], marks: Optional[Marks] = None) -> Tracks:
+    """
+    :param marks: updated in place with the marks of the entries, if given
+    """
+    tracks = dict()
+    for entry in entries:
+        id = TrackingIdentifier.from_dict(entry['id'])
+        tracks[id] = TrackingState.from_dict(entry['state'], id) if entry['state'] is not None else None
+        if marks is not None:
+            if entry.get('mark') is not None:
+                marks[id] = entry['mark']
+            else:
+                marks.pop(id, None)
+    return tracks
+
+
+class DaemonError(RuntimeError):
+    pass
+
+
+class DaemonConnectionLost(ConnectionError):
+    pass
+
+
+class _Subscriber:
+    """
+    the messages queued for one subscribed client
+    """
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self.messages: Deque[bytes] = deque()
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def push(self, message: bytes, snapshot: bytes):
+        with self._cond:
+            if len(self.messages) >= self.max_pending:
+                # a client this far behind is better off starting over
+                self.messages.clear()
+                message = snapshot
+            self.messages.append(message)
+            self._cond.notify()
+
+    def pop(self) -> Optional[bytes]:
+        with self._cond:
+            while not self.messages and not self.closed:
+                self._cond.wait()
+            return self.messages.popleft() if self.messages else None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+class StatePublisher:
+    """
+    Holds the current tracks of the daemon and hands changes to all subscribed clients.
+
+    Messages are encoded once, no matter how many clients are attached.
+    """
+    file: str
+
+    _tracks: Tracks
+    _marks: Marks
+    _snapshot: bytes
+    _subscribers: Set[_Subscriber]
+
+    def __init__(self, file: str, tracks: Tracks, max_pending: int = 64, marks: Optional[Marks] = None):
+        self.file = file
+        self.max_pending = max_pending
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._set_tracks(tracks, marks or {})
+
+    def _set_tracks(self, tracks: Tracks, marks: Marks):
+        self._tracks = tracks
+        self._marks = marks
+        self._snapshot = _encode({
+            'type': 'snapshot',
+            'file': self.file,
+            'tracks': [_entry(id, state, marks.get(id)) for id, state in tracks.items()],
+        })
+
+    def publish(self, tracks: Tracks, marks: Optional[Marks] = None):
+        marks = marks or {}
+        with self._lock:
+            if tracks is self._tracks and marks == self._marks:
+                return
+            old_tracks, old_marks = self._tracks, self._marks
+            self._set_tracks(tracks, marks)
+            if list(tracks) != list(old_tracks):
+                message = self._snapshot
+            else:
+                changed = [
+                    _entry(id, state, marks.get(id)) for id, state in tracks.items()
+                    if state is not old_tracks[id] or marks.get(id) != old_marks.get(id)
+                ]
+                if not changed:
+                    return
+                message = _encode({'type': 'update', 'changed': changed})
+            for subscriber in self._subscribers:
+                subscriber.push(message, self._snapshot)
+
+    def snapshot(self) -> bytes:
+        with self._lock:
+            return self._snapshot
+
+    def subscribe(self) -> _Subscriber:
+        """
+        :return: a subscriber with the current snapshot as its first message
+        """
+        subscriber = _Subscriber(self.max_pending)
+        with self._lock:
+            subscriber.push(self._snapshot, self._snapshot)
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+        subscriber.close()
+
+    def close(self):
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, set()
+        for subscriber in subscribers:
+            subscriber.close()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: '_SocketServer'
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline() or b'{}')
+        except ValueError:
+            request = {}
+        command = request.get('command') if isinstance(request, dict) else None
+        publisher = self.server.publisher
+
+        try:
+            if command == 'snapshot':
+                self.wfile.write(publisher.snapshot())
+            elif command == 'subscribe':
+                self._stream(publisher)
+            elif command == 'stats':
+                self.wfile.write(_encode({'type': 'stats', 'metrics': METRICS.to_dict()}))
+            else:
+                self.wfile.write(_encode({'type': 'error', 'message': 'unknown command {!r}'.format(command)}))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _stream(self, publisher: StatePublisher):
+        subscriber = publisher.subscribe()
+        try:
+            while True:
+                message = subscriber.pop()
+                if message is None:
+                    return
+                self.wfile.write(message)
+                self.wfile.flush()
+        finally:
+            publisher.unsubscribe(subscriber)
+
+
+class _SocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    publisher: StatePublisher
+
+
+class Daemon:
+    """
+    Owns the PackageWatcher of a tracking file and serves its states over a Unix
+    socket, so any number of views and bars share a single poller.
+
+    Once started, it is driven like a PackageWatcher: call tick() and wait() in turns.
+    Its ticks never produce any output.
+    """
+    watcher: PackageWatcher
+    socket_path: str
+    publisher: StatePublisher
+
+    _server: Optional['_SocketServer']
+
+    def __init__(self, watcher: PackageWatcher, socket_path: str):
+        self.watcher = watcher
+        self.socket_path = socket_path
+        self.publisher = StatePublisher(watcher.source_file_name, watcher.tracks, marks=watcher.marks())
+        self._server = None
+
+    def start(self):
+        """
+        start listening on the socket, raises DaemonError if another daemon already does
+        """
+        self._claim_socket()
+        self._server = _SocketServer(self.socket_path, _RequestHandler)
+        self._server.publisher = self.publisher
+        thread = threading.Thread(target=self._server.serve_forever, name='ptrack-daemon', daemon=True)
+        thread.start()
+        logger.info("Serving {} on {}".format(self.watcher.source_file_name, self.socket_path))
+
+    def tick(self) -> None:
+        _, tracks = self.watcher.update()
+        self.publisher.publish(tracks, self.watcher.marks())
+
+    def wait(self):
+        self.watcher.wait()
+
+    def close(self):
+        self.publisher.close()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            os.unlink(self.socket_path)
+            self._server = None
+
+    def serve_forever(self):
+        self.start()
+        try:
+            while True:
+                self.wait()
+                self.tick()
+        finally:
+            self.close()
+
+    def _claim_socket(self):
+        if not os.path.exists(self.socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # left behind by a daemon that didn't shut down cleanly
+            os.unlink(self.socket_path)
+            return
+        finally:
+            probe.close()
+        raise DaemonError("a daemon is already listening on {}".format(self.socket_path))
+
+
+def request_stats(socket_path: str) -> dict:
+    """
+    ask the daemon on socket_path for its metrics
+
+    :return: a Metrics.to_dict() snapshot
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(_encode({'command': 'stats'}))
+        with sock.makefile('rb') as reader:
+            line = reader.readline()
+    if not line:
+        raise DaemonConnectionLost("the daemon on {} went away".format(socket_path))
+    return json.loads(line)['metrics']
+
+
+class DaemonClient:
+    """
+    Displays the states served by a daemon. It can be used in place of a
+    PackageWatcher, but never talks to a carrier itself.
+
+    Connecting raises an OSError if no daemon is listening on socket_path, and
+    wait() raises DaemonConnectionLost if the daemon goes away.
+    """
+    socket_path: str
+    tracks: Tracks
+    marks: Marks
+    renderer: Renderer
+
+    def __init__(self, socket_path: str, display_mode: str = 'compact'):
+        self.socket_path = socket_path
+        self.renderer = Renderer(display_mode)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.connect(socket_path)
+            self._sock.sendall(_encode({'command': 'subscribe'}))
+        except OSError:
+            self._sock.close()
+            raise
+        self._reader = self._sock.makefile('rb')
+        self._pending: List[dict] = []
+        # start out with the snapshot, just like a PackageWatcher starts with the loaded file
+        self.marks = dict()
+        self.tracks = decode_tracks(self._read()['tracks'], self.marks)
+
+    def _read(self) -> dict:
+        line = self._reader.readline()
+        if not line:
+            raise DaemonConnectionLost("the daemon on {} went away".format(self.socket_path))
+        return json.loads(line)
+
+    def wait(self):
+        """
+        Block until the daemon sends the next change.
+        """
+        self._pending.append(self._read())
+
+    def tick(self) -> Optional[str]:
+        new_tracks = self.tracks
+        marks = dict(self.marks)
+        for message in self._pending:
+            if message['type'] == 'snapshot':
+                marks.clear()
+                new_tracks = decode_tracks(message['tracks'], marks)
+            elif message['type'] == 'update':
+                new_tracks = {**new_tracks, **decode_tracks(message['changed'], marks)}
+            else:
+                logger.error("Unexpected message from daemon: {}".format(message))
+        self._pending.clear()
+
+        old_tracks, self.tracks = self.tracks, new_tracks
+        self.marks = marks
+        return self.renderer.render(old_tracks, new_tracks, marks)
+
+    def close(self):
+        self._reader.close()
+        self._sock.close()
@@ -0,0 +1,94 @@
+import json
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from ptrack.modules.models import TrackingIdentifier, TrackingState, TrackingUpdateItem
+
+Tracks = Dict[TrackingIdentifier, Optional[TrackingState]]
+Marks = Dict[TrackingIdentifier, str]
+
+# Every event is a JSON object with at least "type", "time" (when it was noticed)
+# and "package" (the TrackingIdentifier as a dict):
+#
+#   added      the package showed up in the tracking file, with its "state" (or null)
+#   removed    the package was removed from the tracking file
+#   renamed    only the readable name changed, "previous_name" holds the old one
+#   update     the carrier reported a new "update" (TrackingUpdateItem as a dict)
+#   state      the PackageState changed "from" -> "to" (names, null if unknown)
+#   delivered  is_delivered flipped to "value"
+#   retoure    is_retoure flipped to "value"
+
+
+def _update_key(update: TrackingUpdateItem) -> Tuple[str, datetime, Optional[str]]:
+    return update.text, update.when, update.where
+
+
+def _state_name(state: Optional[TrackingState]) -> Optional[str]:
+    return state.state.name if state is not None and state.state is not None else None
+
+
+def diff_state(id: TrackingIdentifier, old: Optional[TrackingState], new: Optional[TrackingState],
+               now: Optional[str] = None) -> List[dict]:
+    """
+    the events between two states of the same package, oldest update first
+    """
+    if old is new:
+        return []
+    base = {'time': now or datetime.now(timezone.utc).isoformat(), 'package': id.to_dict()}
+    events = []
+
+    known = {_update_key(update) for update in old.updates} if old is not None else set()
+    new_updates = [update for update in (new.updates if new is not None else ()) if _update_key(update) not in known]
+    for update in sorted(new_updates, key=lambda update: update.when):
+        events.append({'type': 'update', **base, 'update': update.to_dict()})
+
+    if _state_name(old) != _state_name(new):
+        events.append({'type': 'state', **base, 'from': _state_name(old), 'to': _state_name(new)})
+    for flag in ('delivered', 'retoure'):
+        was = bool(getattr(old, 'is_' + flag)) if old is not None else False
+        now_set = bool(getattr(new, 'is_' + flag)) if new is not None else False
+        if was != now_set:
+            events.append({'type': flag, **base, 'value': now_set})
+    return events
+
+
+def diff_tracks(old_tracks: Tracks, new_tracks: Tracks) -> List[dict]:
+    """
+    All events between two versions of the tracks.
+
+    States are compared by identity first, so unchanged packages cost next to nothing.
+    """
+    if old_tracks is new_tracks:
+        return []
+    now = datetime.now(timezone.utc).isoformat()
+    events = []
+    old_by_key = {(id.number, id.source): id for id in old_tracks}
+    seen = set()
+    for id, state in new_tracks.items():
+        old_id = old_by_key.get((id.number, id.source))
+        if old_id is None:
+            events.append({
+                'type': 'added', 'time': now, 'package': id.to_dict(),
+                'state': state.to_dict() if state is not None else None,
+            })
+            continue
+        seen.add(old_id)
+        if old_id != id:
+            events.append({
+                'type': 'renamed', 'time': now, 'package': id.to_dict(), 'previous_name': old_id.readable_name,
+            })
+        old_state = old_tracks[old_id]
+        if old_state is not state:
+            events.extend(diff_state(id, old_state, state, now))
+    for id in old_tracks:
+        if id not in seen:
+            events.append({'type': 'removed', 'time': now, 'package': id.to_dict()})
+    return events
+
+
+def render_events(old_tracks: Tracks, new_tracks: Tracks, marks: Optional[Marks] = None) -> str:
+    """
+    the events as JSON Lines, empty if there are none. Events only report what carriers
+    said, so marks are ignored.
+    """
+    return "\n".join(json.dumps(event, ensure_ascii=False) for event in diff_tracks(old_tracks, new_tracks))
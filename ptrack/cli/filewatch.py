@@ -0,0 +1,140 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from logging import getLogger
+from typing import Optional
+
+logger = getLogger(__name__)
+
+
+class StatFileWatcher:
+    """
+    Notices changes of a file by stat()ing it every poll_interval seconds.
+
+    Works everywhere, but has to wake up periodically to do so. While the file is
+    missing, e.g. while an editor replaces it, it counts as unchanged.
+    """
+    path: str
+    poll_interval: float
+
+    def __init__(self, path: str, poll_interval: float = 1):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._version = self._stat()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the file changed or timeout seconds passed.
+
+        :return: True if the file changed
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            version = self._stat()
+            if version is not None and version != self._version:
+                self._version = version
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(self.poll_interval, remaining))
+            else:
+                time.sleep(self.poll_interval)
+
+    def close(self):
+        pass
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class InotifyFileWatcher:
+    """
+    Notices changes of a file through Linux' inotify, without waking up in between.
+
+    The directory containing the file is watched instead of the file itself, so
+    editors that save by writing a new file and moving it over the old one are
+    noticed too. Moving the file away or deleting it isn't a change by itself, only
+    the new file showing up is.
+    """
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+
+    EVENT_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    _EVENT_HEADER = struct.Struct('iIII')
+
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+        self._name = os.fsencode(os.path.basename(path))
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        directory = os.path.dirname(os.path.abspath(path))
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), self.EVENT_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, "inotify_add_watch failed for {}".format(directory))
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the file changed or timeout seconds passed.
+
+        :return: True if the file changed
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            remaining = max(deadline - time.monotonic(), 0) if deadline is not None else None
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if readable and self._read_events():
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def close(self):
+        os.close(self._fd)
+
+    def _read_events(self) -> bool:
+        """
+        drain all pending events and check if any of them concern our file
+        """
+        changed = False
+        while True:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(buffer):
+                _, _, _, length = self._EVENT_HEADER.unpack_from(buffer, offset)
+                offset += self._EVENT_HEADER.size
+                if buffer[offset:offset + length].rstrip(b'\0') == self._name:
+                    changed = True
+                offset += length
+
+
+def file_watcher_for(path: str, poll_interval: float = 1):
+    """
+    An inotify based watcher on Linux, or a stat polling one where that is not available.
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyFileWatcher(path)
+        except (OSError, AttributeError):
+            logger.warning("inotify is not available, falling back to polling {}".format(path))
+    return StatFileWatcher(path, poll_interval)
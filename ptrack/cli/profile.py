@@ -0,0 +1,111 @@
+import cProfile
+import pstats
+import sys
+import threading
+from contextlib import contextmanager
+from logging import getLogger
+from typing import Iterator, List
+
+logger = getLogger(__name__)
+
+# from 3.12 on cProfile is built on sys.monitoring, which allows a single profiler for
+# the whole process. It sees all threads, so worker threads don't get profiles of their own.
+_PROFILE_PER_THREAD = sys.version_info < (3, 12)
+
+
+class _DisableOnExit:
+    """
+    Kept in a thread local, so it is dropped on the thread it was created on when that
+    thread ends, which is the only thread that can disable a profile enabled there.
+    """
+
+    def __init__(self, profiler: 'TickProfiler', profile: cProfile.Profile):
+        self.profiler = profiler
+        self.profile = profile
+
+    def __del__(self):
+        self.profile.disable()
+        self.profiler._finished(self.profile)
+
+
+class TickProfiler:
+    """
+    Profiles the first `ticks` ticks with cProfile and dumps them into a single pstats
+    file, which snakeviz, flameprof or gprof2dot turn into a flame graph.
+
+    Before Python 3.12 cProfile only sees the thread it was enabled on, so lookups
+    running on the refresh engines worker threads get a profile of their own through
+    thread_initializer. Each is disabled when its thread ends, and those that ended are
+    merged when the dump is written. Profiling never gets in the way of lookups, if it
+    can't be enabled (e.g. another profiler is active) it is skipped.
+    """
+    ticks: int
+    path: str
+
+    # worker profiles that are still enabled, and those whose threads ended
+    _profiles: List[cProfile.Profile]
+    _done_profiles: List[cProfile.Profile]
+
+    def __init__(self, ticks: int, path: str):
+        self.ticks = ticks
+        self.path = path
+        self._main = cProfile.Profile()
+        self._profiles = []
+        self._done_profiles = []
+        self._done = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def active(self) -> bool:
+        return self._done < self.ticks
+
+    def thread_initializer(self):
+        if not self.active or not _PROFILE_PER_THREAD:
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            logger.warning("Not profiling {}: {}".format(threading.current_thread().name, e))
+            return
+        with self._lock:
+            self._profiles.append(profile)
+        self._local.disable_on_exit = _DisableOnExit(self, profile)
+
+    def _finished(self, profile: cProfile.Profile):
+        with self._lock:
+            self._profiles.remove(profile)
+            if self.active:
+                self._done_profiles.append(profile)
+
+    @contextmanager
+    def tick(self) -> Iterator[None]:
+        if not self.active:
+            yield
+            return
+        try:
+            self._main.enable()
+        except ValueError as e:
+            logger.warning("Not profiling this tick: {}".format(e))
+            yield
+            return
+        try:
+            yield
+        finally:
+            self._main.disable()
+            self._done += 1
+            if not self.active:
+                self.dump()
+
+    def dump(self):
+        stats = pstats.Stats(self._main)
+        with self._lock:
+            for profile in self._done_profiles:
+                stats.add(profile)
+            running = len(self._profiles)
+            self._done_profiles = []
+        stats.dump_stats(self.path)
+        logger.info("Wrote profile of {} ticks to {}".format(self._done, self.path))
+        if running:
+            logger.info("{} worker threads were still running and aren't part of it".format(running))
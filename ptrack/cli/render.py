@@ -0,0 +1,187 @@
+import hashlib
+import json
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import ptrack.cli.color as color
+import ptrack.cli.symbols as symbols
+from ptrack.cli.events import Marks, render_events
+from ptrack.modules.models import TrackingState, TrackingIdentifier, PackageState
+
+Tracks = Dict[TrackingIdentifier, Optional[TrackingState]]
+
+# marks of packages whose lookup is still running while they are rendered
+PENDING = 'pending'  # never fetched, shown as a placeholder
+STALE = 'stale'  # its refresh is overdue, shown with the last known state
+
+
+def render_compact(old_tracks: Tracks, new_tracks: Tracks, marks: Optional[Marks] = None) -> str:
+    marks = marks or {}
+    removed = set(old_tracks.keys()) - set(new_tracks.keys())
+    added = set(new_tracks.keys()) - set(old_tracks.keys())
+
+    all_tracks: Tracks = {
+        **old_tracks,
+        **new_tracks
+    }
+    lines = []
+    id: TrackingIdentifier
+    for id in sorted(all_tracks.keys(), key=lambda id: id.number):
+        info = all_tracks[id]
+        if info is None:
+            lines.append("{}: {}".format(
+                id.readable_name or id.number, "fetching..." if marks.get(id) == PENDING else "not found"
+            ))
+            continue
+        lines.append("{}{:<20}: {} {} {}{} {}{}{}".format(
+            color.RED if id in removed else (color.GREEN if id in added else ""),
+            id.readable_name or id.number,
+            print_date_time(info.last_update),
+            generate_progress_bar(*info.progress),
+            get_icon_for(info.state),
+            (" " + info.updates[0].where + ',') if len(info.updates) > 0 and info.updates[0].where else "",
+            info.short_description,
+            " (stale)" if marks.get(id) == STALE else "",
+            color.RESET
+        ))
+    return "\033[H\033[2J" + "\n".join(lines)
+
+
+def render_i3bar(old_tracks: Tracks, new_tracks: Tracks, marks: Optional[Marks] = None) -> str:
+    marks = marks or {}
+    return " | ".join(
+        i3bar_text(id, info, marks.get(id)) for id, info in new_tracks.items()
+        if info is not None or marks.get(id) == PENDING
+    )
+
+
+def render_i3bar_json(old_tracks: Tracks, new_tracks: Tracks, marks: Optional[Marks] = None) -> str:
+    """
+    One status line of the i3bar/swaybar protocol, with a block per package.
+    """
+    return json.dumps(i3bar_blocks(new_tracks, marks), ensure_ascii=False) + ","
+
+
+def render_exhaustive(old_tracks: Tracks, new_tracks: Tracks, marks: Optional[Marks] = None) -> str:
+    marks = marks or {}
+    return "\n".join(
+        "\n\n" + (
+            ("Fetching {}" if marks.get(id) == PENDING else "Nothing for {}").format(id) if info is None else
+            info.pretty_print() + ("\n\n(refresh overdue, this is the last known state)" if marks.get(id) == STALE else "")
+        )
+        for id, info in new_tracks.items()
+    )
+
+
+def i3bar_text(id: TrackingIdentifier, info: Optional[TrackingState], mark: Optional[str] = None) -> str:
+    if info is None:
+        return "{}: {}".format(id.readable_name or id.number, symbols.HOURGLASS)
+    return "{}: {} {}{}".format(
+        id.readable_name or id.number,
+        generate_progress_bar(*info.progress),
+        get_icon_for(info.state),
+        " " + symbols.HOURGLASS if mark == STALE else ""
+    )
+
+
+def i3bar_blocks(tracks: Tracks, marks: Optional[Marks] = None) -> List[dict]:
+    marks = marks or {}
+    blocks = []
+    for id, info in tracks.items():
+        mark = marks.get(id)
+        if info is None and mark != PENDING:
+            continue
+        block = {
+            'name': 'ptrack',
+            'instance': id.number,
+            'full_text': i3bar_text(id, info, mark),
+            'short_text': get_icon_for(info.state) if info is not None else symbols.HOURGLASS,
+        }
+        if mark is not None:
+            block['color'] = '#888888'
+        elif info.is_delivered:
+            block['color'] = '#00ff00'
+        blocks.append(block)
+    return blocks
+
+
+class Renderer:
+    """
+    Renders package states in one of the display modes, but only when the output
+    would differ from what was rendered last.
+
+    The last output is remembered as a fingerprint, and rendering is skipped entirely
+    if render is called with the same, unchanged dict as last time.
+
+    Stream modes print what changed instead of the whole picture, their output is
+    never compared to the last one, only dropped if empty.
+
+    Marks (PENDING, STALE) tell the modes about packages whose lookup is still running.
+    """
+    MODES: Dict[str, Callable[[Tracks, Tracks, Optional[Marks]], str]] = {
+        'compact': render_compact,
+        'i3bar': render_i3bar,
+        'i3bar-json': render_i3bar_json,
+        'exhaustive': render_exhaustive,
+        'events': render_events,
+    }
+    STREAM_MODES = {'events'}
+
+    mode: str
+
+    def __init__(self, mode: str = 'compact'):
+        self.mode = mode if mode in self.MODES else 'compact'
+        self._fingerprint = None
+        # the tracks of the last call, if it was handed the same dict twice. Holding on
+        # to both dicts of a call would keep the old states alive until the next one.
+        self._last_unchanged: Optional[Tracks] = None
+        self._last_marks: Marks = {}
+
+    def render(self, old_tracks: Tracks, new_tracks: Tracks, marks: Optional[Marks] = None) -> Optional[str]:
+        """
+        :return: the new output, or None if nothing changed since the last call
+        """
+        marks = marks or {}
+        if old_tracks is new_tracks and self._last_unchanged is new_tracks and marks == self._last_marks:
+            return None
+        self._last_unchanged = new_tracks if old_tracks is new_tracks else None
+        self._last_marks = marks
+
+        output = self.MODES[self.mode](old_tracks, new_tracks, marks)
+        if self.mode in self.STREAM_MODES:
+            return output or None
+        fingerprint = hashlib.blake2b(output.encode(), digest_size=16).digest()
+        if fingerprint == self._fingerprint:
+            return None
+        if self._fingerprint is None and self.mode == 'i3bar-json':
+            # the protocol header and the opening of the infinite array precede the first status line
+            output = json.dumps({'version': 1}) + "\n[\n" + output
+        self._fingerprint = fingerprint
+        return output
+
+
+def generate_progress_bar(at: int, ttl: int):
+    return ('█' * at) + ('░' * (ttl - at))
+
+
+def print_date_time(dt: datetime):
+    if dt < datetime(2000, 1, 1, tzinfo=dt.tzinfo):
+        return "??.??. ??:??"
+    # carriers report times in their own timezone
+    return dt.astimezone().strftime('%d.%m. %H:%M')
+
+
+def get_icon_for(state: PackageState):
+    if state == PackageState.ANNOUNCED:
+        return symbols.MEGAPHONE
+    if state in (PackageState.ARRIVED_AT_INGRES, PackageState.ON_THE_WAY, PackageState.ARRIVED_AT_DESTINATION):
+        return symbols.SHIPPING_TRUCK
+    if state == PackageState.OUT_FOR_DELIVERY:
+        return symbols.DELIVERY_TRUCK
+    if state == PackageState.DELIVERED:
+        return symbols.CHECKMARK_BOX
+    if state == PackageState.CUSTOMS:
+        return symbols.CUSTOMS
+    if state == PackageState.READY_FOR_COLLECTION:
+        return symbols.POSTAL_HORN
+    return symbols.QUESTION_MARK
@@ -0,0 +1,81 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from ptrack.modules.archive import ArchiveEntry, ResponseArchive
+from ptrack.modules.models import TrackingIdentifier, TrackingState
+from ptrack.modules.registry import ALL_MODULES, SupplierPool
+
+logger = getLogger(__name__)
+
+
+@dataclass
+class ReparseResult:
+    entry: ArchiveEntry
+    states: Dict[TrackingIdentifier, Optional[TrackingState]]
+    # the exception the parser raised, if it did
+    error: Optional[str]
+    seconds: float
+    size: int
+
+
+def reparse_entry(archive: ResponseArchive, trackers: SupplierPool, entry: ArchiveEntry) -> ReparseResult:
+    """
+    parse a single archived response with the current parser of its carrier
+    """
+    raw = archive.load(entry)
+    start = time.perf_counter()
+    try:
+        if entry.carrier not in trackers:
+            raise KeyError("unknown carrier {!r}".format(entry.carrier))
+        states, error = trackers[entry.carrier].parse_raw(raw, list(entry.ids)), None
+    except Exception as e:
+        states, error = {}, "{}: {}".format(type(e).__name__, e)
+    return ReparseResult(entry, states, error, time.perf_counter() - start, len(raw))
+
+
+# the archive and suppliers of a worker process, see _init_worker
+_archive: Optional[ResponseArchive] = None
+_trackers: Optional[SupplierPool] = None
+
+
+def _init_worker(archive_path: str):
+    global _archive, _trackers
+    _archive = ResponseArchive(archive_path)
+    _trackers = SupplierPool(ALL_MODULES)
+
+
+def _reparse_chunk(entries: List[ArchiveEntry]) -> List[ReparseResult]:
+    return [reparse_entry(_archive, _trackers, entry) for entry in entries]
+
+
+def reparse(archive: ResponseArchive, carriers: Optional[Iterable[str]] = None, processes: Optional[int] = None,
+            chunk_size: int = 16) -> Iterator[ReparseResult]:
+    """
+    Parse archived responses again with the current parsers, spread over a pool of
+    processes, without any network access.
+
+    :param carriers: only parse the responses of these carriers
+    :param processes: size of the pool, one per core by default. With 1, everything is
+                      parsed in this process.
+    :return: the results, in the order the responses were first seen. Responses of
+             carriers that can't parse them again are skipped.
+    """
+    entries = archive.entries(carriers)
+    unsupported = {entry.carrier for entry in entries
+                   if entry.carrier in ALL_MODULES and not ALL_MODULES[entry.carrier][0].parses_raw()}
+    for carrier in sorted(unsupported):
+        logger.warning("skipping the responses of {}, it can't parse archived responses".format(carrier))
+    entries = [entry for entry in entries if entry.carrier not in unsupported]
+    if processes == 1:
+        trackers = SupplierPool(ALL_MODULES)
+        for entry in entries:
+            yield reparse_entry(archive, trackers, entry)
+        return
+
+    chunks = [entries[i:i + chunk_size] for i in range(0, len(entries), chunk_size)]
+    with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(archive.path,)) as pool:
+        for results in pool.map(_reparse_chunk, chunks):
+            yield from results
@@ -0,0 +1,127 @@
+import heapq
+import itertools
+import random
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from ptrack.modules.models import PackageState, TrackingIdentifier, TrackingState
+
+
+class PollScheduler:
+    """
+    Decides when each package is due for its next refresh.
+
+    The interval depends on how far along a package is (a package out for delivery
+    changes by the hour, an announced one may sit for days), on how long ago the
+    carrier last reported anything and on the carrier itself. Delivered packages are
+    not polled anymore. Due times are jittered a bit, so packages that were fetched
+    together drift apart instead of all becoming due in the same tick.
+
+    Packages are kept in a priority queue ordered by due time, rescheduling a package
+    just pushes a new entry and leaves the old one to be skipped when popped.
+    """
+    STATE_INTERVALS: Dict[Optional[PackageState], float] = {
+        PackageState.ANNOUNCED: 60 * 60,
+        PackageState.ARRIVED_AT_INGRES: 30 * 60,
+        PackageState.ON_THE_WAY: 20 * 60,
+        PackageState.ARRIVED_AT_DESTINATION: 15 * 60,
+        PackageState.OUT_FOR_DELIVERY: 5 * 60,
+        PackageState.CUSTOMS: 60 * 60,
+        PackageState.READY_FOR_COLLECTION: 2 * 60 * 60,
+    }
+    # packages the carrier did not know (yet), or with a state we can't map
+    UNKNOWN_INTERVAL = 30 * 60
+
+    # every QUIET_PERIOD without news from the carrier doubles the interval,
+    # up to MAX_INTERVAL
+    QUIET_PERIOD = 2 * 24 * 60 * 60
+    MAX_INTERVAL = 6 * 60 * 60
+
+    # GlobalPost only reports the first and last event, polling it often gains nothing
+    CARRIER_FACTORS: Dict[str, float] = {
+        'globalpost': 2,
+    }
+
+    JITTER = 0.1
+
+    carrier_factors: Dict[str, float]
+
+    _queue: List[Tuple[float, int, TrackingIdentifier]]
+    _due: Dict[TrackingIdentifier, float]
+
+    def __init__(self, carrier_factors: Optional[Dict[str, float]] = None):
+        self.carrier_factors = {**self.CARRIER_FACTORS, **(carrier_factors or {})}
+        self._queue = []
+        self._due = dict()
+        self._counter = itertools.count()
+
+    def interval_for(self, id: TrackingIdentifier, state: Optional[TrackingState],
+                     now: Optional[float] = None) -> Optional[float]:
+        """
+        How long to wait before refreshing a package, or None if it should not be refreshed anymore.
+        """
+        if state is None:
+            return self.UNKNOWN_INTERVAL * self.carrier_factors.get(id.source, 1)
+        if state.is_delivered or state.state == PackageState.DELIVERED:
+            return None
+
+        interval = self.STATE_INTERVALS.get(state.state, self.UNKNOWN_INTERVAL)
+        if state.last_update >= datetime(2000, 1, 1, tzinfo=state.last_update.tzinfo):
+            quiet_for = (now or time.time()) - state.last_update.timestamp()
+            interval *= 2 ** max(int(quiet_for // self.QUIET_PERIOD), 0)
+        interval *= self.carrier_factors.get(id.source, 1)
+        return min(interval, self.MAX_INTERVAL)
+
+    def schedule(self, id: TrackingIdentifier, state: Optional[TrackingState], fetched_at: float):
+        """
+        Schedule the next refresh of a package that was fetched at fetched_at.
+        """
+        interval = self.interval_for(id, state, fetched_at)
+        if interval is None:
+            self.remove(id)
+            return
+        self._push(id, fetched_at + interval * random.uniform(1 - self.JITTER, 1 + self.JITTER))
+
+    def schedule_now(self, id: TrackingIdentifier):
+        self._push(id, 0)
+
+    def rename(self, old: TrackingIdentifier, new: TrackingIdentifier):
+        """
+        Move the schedule of old over to new, e.g. when only the readable name of a package changed.
+        """
+        if old in self._due:
+            self._push(new, self._due.pop(old))
+
+    def remove(self, id: TrackingIdentifier):
+        self._due.pop(id, None)
+
+    def pop_due(self, now: Optional[float] = None) -> List[TrackingIdentifier]:
+        """
+        Take all packages out of the queue that are due at now.
+
+        They stay unscheduled until they are scheduled again after their refresh.
+        """
+        now = time.time() if now is None else now
+        due = []
+        while self._queue and self._queue[0][0] <= now:
+            when, _, id = heapq.heappop(self._queue)
+            if self._due.get(id) == when:
+                del self._due[id]
+                due.append(id)
+        return due
+
+    def next_due(self) -> Optional[float]:
+        """
+        The time at which the next package becomes due, or None if nothing is scheduled.
+        """
+        while self._queue and self._due.get(self._queue[0][2]) != self._queue[0][0]:
+            heapq.heappop(self._queue)
+        return self._queue[0][0] if self._queue else None
+
+    def __contains__(self, id: TrackingIdentifier):
+        return id in self._due
+
+    def _push(self, id: TrackingIdentifier, when: float):
+        self._due[id] = when
+        heapq.heappush(self._queue, (when, next(self._counter), id))
@@ -0,0 +1,266 @@
+import asyncio
+import itertools
+import multiprocessing
+import pickle
+import queue
+import threading
+import zlib
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging import getLogger
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+
+from ptrack.modules.archive import active_archive, configure_archive
+from ptrack.modules.metrics import METRICS
+from ptrack.modules.models import TrackingIdentifier, TrackingState, TrackingSupplier
+from ptrack.modules.registry import ALL_MODULES, Carrier, SupplierPool
+from ptrack.modules.transport import TransportConfig, configure_shared_transport, shared_transport
+from .watch import RefreshEngine
+
+logger = getLogger(__name__)
+
+Results = Dict[TrackingIdentifier, Optional[TrackingState]]
+
+
+def shard_of(id: TrackingIdentifier, shards: int) -> int:
+    # crc32 instead of hash(), which is salted differently in every process
+    return zlib.crc32(id.number.encode()) % shards
+
+
+def _picklable(error: BaseException) -> BaseException:
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        cls = OSError if isinstance(error, OSError) else RuntimeError
+        return cls("{}: {}".format(type(error).__name__, error))
+
+
+def _worker_main(requests: 'multiprocessing.Queue', responses: 'multiprocessing.Queue', threads: int,
+                 transport_config: TransportConfig, archive_path: Optional[str], carriers: Dict[str, Carrier]):
+    """
+    Entry point of a shard process: runs the lookups it is sent on a thread pool.
+
+    States the supplier handed back unchanged (the very same object as last time)
+    are only reported by id, the coordinator still has them. Lookups marked as full
+    report every state, and packages the coordinator forgot are forgotten here too.
+    The metrics recorded by a lookup are sent back with its result.
+    """
+    for name, (cls, config_cls) in carriers.items():
+        ALL_MODULES.register(name, cls, config_cls)
+    configure_shared_transport(transport_config)
+    if archive_path is not None:
+        configure_archive(archive_path)
+    trackers = SupplierPool(ALL_MODULES)
+    last: Results = dict()
+    lock = threading.Lock()
+
+    def run(request_id: int, source: str, chunk: List[TrackingIdentifier], full: bool):
+        try:
+            tracker = trackers[source]
+            if len(chunk) == 1:
+                results = tracker._measured(chunk, lambda: {chunk[0]: tracker.get_details_for(chunk[0])})
+            else:
+                results = tracker._measured(chunk, lambda: tracker.get_details_for_many(chunk))
+            with lock:
+                unchanged = [] if full else [id for id, state in results.items() if id in last and last[id] is state]
+                last.update(results)
+            for id in unchanged:
+                del results[id]
+            responses.put((request_id, None, (results, unchanged), METRICS.drain()))
+        except BaseException as e:
+            responses.put((request_id, _picklable(e), None, METRICS.drain()))
+
+    with ThreadPoolExecutor(threads, thread_name_prefix='ptrack-shard') as pool:
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            kind, *args = request
+            if kind == 'forget':
+                with lock:
+                    for id in args[0]:
+                        last.pop(id, None)
+            else:
+                pool.submit(run, *args)
+    responses.put(None)
+
+
+class ShardWorker:
+    """
+    A worker process and the lookups in flight on it.
+
+    Workers are spawned rather than forked: they are started from the lookup threads,
+    and a forked child could inherit a lock another thread held at that moment.
+    Carriers registered at runtime are passed to them, so their classes have to be
+    importable, i.e. not defined in a script without an `if __name__ == '__main__'` guard.
+    """
+    index: int
+
+    _futures: Dict[int, Future]
+
+    def __init__(self, index: int, threads: int, transport_config: TransportConfig, archive_path: Optional[str] = None):
+        self.index = index
+        context = multiprocessing.get_context('spawn')
+        self._requests = context.Queue()
+        self._responses = context.Queue()
+        self._futures = dict()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._process = context.Process(
+            target=_worker_main, args=(self._requests, self._responses, threads, transport_config, archive_path,
+                                       ALL_MODULES.registered()),
+            name='ptrack-shard-{}'.format(index), daemon=True,
+        )
+        self._process.start()
+        self._reader = threading.Thread(target=self._read_responses, name='ptrack-shard-{}-reader'.format(index),
+                                        daemon=True)
+        self._reader.start()
+
+    @property
+    def alive(self) -> bool:
+        return self._process.is_alive()
+
+    def submit(self, source: str, chunk: List[TrackingIdentifier], full: bool = False) -> Future:
+        """
+        look up chunk on the worker
+
+        :param full: return all states, even those the worker reported before
+        :return: a future of the changed states and the ids whose state didn't change
+        """
+        future = Future()
+        with self._lock:
+            request_id = next(self._counter)
+            self._futures[request_id] = future
+        self._requests.put(('lookup', request_id, source, chunk, full))
+        return future
+
+    def forget(self, ids: List[TrackingIdentifier]):
+        self._requests.put(('forget', ids))
+
+    def _read_responses(self):
+        while True:
+            try:
+                response = self._responses.get(timeout=1)
+            except queue.Empty:
+                if not self._process.is_alive():
+                    self._fail_all(RuntimeError("shard worker {} died".format(self.index)))
+                    return
+                continue
+            if response is None:
+                self._fail_all(RuntimeError("shard worker {} stopped".format(self.index)))
+                return
+            request_id, error, result, metrics = response
+            METRICS.merge(metrics)
+            with self._lock:
+                future = self._futures.pop(request_id)
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _fail_all(self, error: BaseException):
+        with self._lock:
+            futures, self._futures = self._futures, dict()
+        for future in futures.values():
+            future.set_exception(error)
+
+    def close(self):
+        if self._process.is_alive():
+            self._requests.put(None)
+            self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
+
+
+class ShardedRefreshEngine(RefreshEngine):
+    """
+    A RefreshEngine that does the lookups, and with them all the parsing, in `shards`
+    worker processes, so parsing isn't bound to a single core by the GIL.
+
+    Packages are assigned to a shard by a hash of their tracking number, so a package
+    always ends up on the same worker and that workers response cache. Concurrency and
+    rate limits, as well as the circuit breakers, stay in this process and therefore
+    apply across all shards, and all results are merged back into one dict.
+    """
+    shards: int
+    transport_config: TransportConfig
+    # where workers archive responses, see ptrack.modules.archive
+    archive_path: Optional[str]
+
+    _workers: List[Optional[ShardWorker]]
+    # the last state of every package, to resolve the ids workers report as unchanged
+    _last: Results
+
+    def __init__(self, trackers: Mapping[str, TrackingSupplier], shards: int,
+                 transport_config: Optional[TransportConfig] = None, archive_path: Optional[str] = None, **kwargs):
+        super().__init__(trackers, **kwargs)
+        self.shards = shards
+        self.transport_config = transport_config or shared_transport().config
+        if archive_path is None and active_archive() is not None:
+            archive_path = active_archive().path
+        self.archive_path = archive_path
+        self._workers = [None] * shards
+        self._last = dict()
+        self._lock = threading.Lock()
+
+    def worker(self, shard: int) -> ShardWorker:
+        """
+        the worker of a shard, (re)started if it isn't running
+        """
+        with self._lock:
+            worker = self._workers[shard]
+            if worker is None or not worker.alive:
+                if worker is not None:
+                    logger.warning("Restarting shard worker {}".format(shard))
+                # every worker gets its share of the lookups that may be in flight
+                threads = max(-(-self.max_concurrency // self.shards), 1)
+                worker = self._workers[shard] = ShardWorker(shard, threads, self.transport_config, self.archive_path)
+            return worker
+
+    async def lookup(self, source: str, chunk: List[TrackingIdentifier]) -> Results:
+        worker = self.worker(shard_of(chunk[0], self.shards))
+        results, unchanged = await asyncio.wrap_future(worker.submit(source, chunk))
+        with self._lock:
+            self._last.update(results)
+            missing = [id for id in unchanged if id not in self._last]
+            results.update((id, self._last[id]) for id in unchanged if id in self._last)
+        if missing:
+            # forgotten here while a lookup on the worker still remembered them
+            again, _ = await asyncio.wrap_future(worker.submit(source, missing, full=True))
+            with self._lock:
+                self._last.update(again)
+            results.update(again)
+        return results
+
+    def forget(self, ids: List[TrackingIdentifier]):
+        super().forget(ids)
+        by_shard: Dict[int, List[TrackingIdentifier]] = defaultdict(list)
+        with self._lock:
+            for id in ids:
+                self._last.pop(id, None)
+                by_shard[shard_of(id, self.shards)].append(id)
+            workers = list(self._workers)
+        # workers that aren't running don't remember anything
+        for shard, shard_ids in by_shard.items():
+            if workers[shard] is not None and workers[shard].alive:
+                workers[shard].forget(shard_ids)
+
+    def close(self):
+        with self._lock:
+            workers, self._workers = self._workers, [None] * self.shards
+        for worker in workers:
+            if worker is not None:
+                worker.close()
+
+    def _chunks(self, ids: List[TrackingIdentifier]) -> Iterator[Tuple[str, List[TrackingIdentifier]]]:
+        """
+        like RefreshEngine._chunks, but a chunk never spans shards
+        """
+        by_shard: Dict[Tuple[str, int], List[TrackingIdentifier]] = defaultdict(list)
+        for id in ids:
+            by_shard[id.source, shard_of(id, self.shards)].append(id)
+        for (source, _), shard_ids in by_shard.items():
+            size = max(self.trackers[source].batch_size, 1)
+            for i in range(0, len(shard_ids), size):
+                yield source, shard_ids[i:i + size]
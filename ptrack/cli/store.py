@@ -0,0 +1,104 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from ptrack.modules.models import TrackingIdentifier, TrackingState
+
+
+def default_store_path() -> str:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'ptrack', 'state.sqlite3')
+
+
+# packages per query in load, SQLite allows 999 parameters in older versions
+_LOAD_CHUNK = 400
+
+
+class StateStore:
+    """
+    Keeps the last known state of every package in a local SQLite database.
+
+    Entries are keyed by source and tracking number, so renaming a package in the
+    tracking file keeps its cached state. A state of None means the carrier did not
+    know the package when it was last fetched.
+
+    Entries that weren't fetched for max_age seconds, e.g. of packages that were
+    removed from the tracking file long ago, are deleted when the store is opened.
+    """
+    path: str
+    max_age: Optional[float]
+
+    def __init__(self, path: str, max_age: Optional[float] = 90 * 24 * 60 * 60):
+        self.path = path
+        self.max_age = max_age
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS states ('
+                '  source TEXT NOT NULL,'
+                '  number TEXT NOT NULL,'
+                '  fetched_at REAL NOT NULL,'
+                '  state TEXT,'
+                '  PRIMARY KEY (source, number)'
+                ')'
+            )
+            if max_age is not None:
+                self._conn.execute('DELETE FROM states WHERE fetched_at < ?', (time.time() - max_age,))
+
+    def load(self, ids: Iterable[TrackingIdentifier]) -> Dict[TrackingIdentifier, Tuple[float, Optional[TrackingState]]]:
+        """
+        Look up the stored states of the given packages.
+
+        :return: fetch time and state for every id that has a stored entry
+        """
+        wanted = {(id.source, id.number): id for id in ids}
+        keys = list(wanted)
+        rows = []
+        with self._lock:
+            for i in range(0, len(keys), _LOAD_CHUNK):
+                chunk = keys[i:i + _LOAD_CHUNK]
+                # a join, unlike IN, looks every key up in the primary key index
+                rows += self._conn.execute(
+                    'SELECT s.source, s.number, s.fetched_at, s.state FROM (VALUES {}) AS k'
+                    ' JOIN states AS s ON s.source = k.column1 AND s.number = k.column2'
+                    .format(', '.join(['(?, ?)'] * len(chunk))),
+                    [value for key in chunk for value in key]
+                ).fetchall()
+
+        result = dict()
+        for source, number, fetched_at, state in rows:
+            id = wanted.get((source, number))
+            if id is None:
+                continue
+            result[id] = (fetched_at, TrackingState.from_dict(json.loads(state), id) if state is not None else None)
+        return result
+
+    def save(self, states: Dict[TrackingIdentifier, Optional[TrackingState]], fetched_at: float):
+        rows = [
+            (id.source, id.number, fetched_at, json.dumps(state.to_dict()) if state is not None else None)
+            for id, state in states.items()
+        ]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO states VALUES (?, ?, ?, ?)', rows)
+
+    def touch(self, ids: Iterable[TrackingIdentifier], fetched_at: float):
+        """
+        Update the fetch time of packages whose state didn't change.
+        """
+        rows = [(fetched_at, id.source, id.number) for id in ids]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany('UPDATE states SET fetched_at = ? WHERE source = ? AND number = ?', rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -10,3 +10,4 @@ CHECKMARK_BOX = "✅"
 CROSS = "❌"
 POSTAL_HORN = "📯"
 QUESTION_MARK = "❔"
+HOURGLASS = "⏳"
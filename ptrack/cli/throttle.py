@@ -0,0 +1,164 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from logging import getLogger
+from typing import Deque, Optional, Tuple
+
+logger = getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average, with bursts of up to burst requests.
+
+    Callers reserve a token and wait for the returned delay. Tokens can go negative,
+    so concurrent callers queue up behind each other instead of all waking at once.
+    """
+    rate: float
+    burst: float
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        take a token
+
+        :return: seconds to wait before the request may be sent
+        """
+        if self.rate <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            return max(-self._tokens / self.rate, 0)
+
+
+class ConcurrencyLimit:
+    """
+    Lets at most limit tasks in at a time, like an asyncio.Semaphore, but shared by
+    the event loops of all threads. The refresh engine runs one loop per refresh,
+    and several refreshes run at once on the background threads of the watcher.
+
+    A slot that is released goes to the longest waiting task, on its own loop.
+    """
+    limit: int
+
+    _waiters: Deque[Tuple[asyncio.AbstractEventLoop, 'asyncio.Future[None]']]
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._held = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._held < self.limit and not self._waiters:
+                self._held += 1
+                return
+            waiter = loop.create_future()
+            self._waiters.append((loop, waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                if (loop, waiter) in self._waiters:
+                    self._waiters.remove((loop, waiter))
+            # otherwise the slot was already handed over, _wake gives it back
+            raise
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self._held -= 1
+                return
+            # handed over as it is, _held stays the same
+            loop, waiter = self._waiters.popleft()
+        loop.call_soon_threadsafe(self._wake, waiter)
+
+    def _wake(self, waiter: 'asyncio.Future[None]'):
+        if waiter.cancelled():
+            self.release()
+        else:
+            waiter.set_result(None)
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class CircuitBreaker:
+    """
+    Stops lookups at a carrier that keeps failing.
+
+    After failure_threshold failures in a row (or a single 429/5xx response), the
+    circuit opens and allow() refuses all lookups for a backoff period, which doubles
+    with every failure up to max_backoff and is at least what the carrier asked for
+    in Retry-After. Once it passes, a single probe lookup is let through: if it
+    succeeds the circuit closes again, otherwise it stays open for the next period.
+    """
+    name: str
+    failure_threshold: int
+    base_backoff: float
+    max_backoff: float
+
+    def __init__(self, name: str, failure_threshold: int = 3, base_backoff: float = 30,
+                 max_backoff: float = 30 * 60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._failures = 0
+        self._open_until: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._open_until is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._open_until is None:
+                return True
+            if self._probing or time.monotonic() < self._open_until:
+                return False
+            self._probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            if self._open_until is not None:
+                logger.info("{} is healthy again".format(self.name))
+            self._failures = 0
+            self._open_until = None
+            self._probing = False
+
+    def failure(self, overloaded: bool = False, retry_after: Optional[float] = None):
+        """
+        record a failed lookup
+
+        :param overloaded: the carrier answered with 429 or 5xx, open right away
+        :param retry_after: seconds the carrier asked us to wait
+        """
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._open_until is None and not overloaded and self._failures < self.failure_threshold:
+                return
+            exponent = max(self._failures - self.failure_threshold, 0) if not overloaded else self._failures - 1
+            backoff = min(self.base_backoff * 2 ** exponent, self.max_backoff)
+            backoff = max(backoff, min(retry_after or 0, self.max_backoff))
+            self._open_until = time.monotonic() + backoff
+            logger.warning("{} is unhealthy, pausing lookups for {:.0f}s".format(self.name, backoff))
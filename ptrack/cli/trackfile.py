@@ -0,0 +1,220 @@
+import csv
+import dataclasses
+import json
+import os
+from logging import getLogger
+from typing import Container, Dict, Iterator, List, Optional
+
+from ptrack.modules.models import TrackingIdentifier
+
+logger = getLogger(__name__)
+
+# column names accepted in the header of a CSV file
+CSV_COLUMNS: Dict[str, str] = {
+    'number': 'number',
+    'tracking_number': 'number',
+    'tracking number': 'number',
+    'tracking_id': 'number',
+    'tracking id': 'number',
+    'source': 'source',
+    'carrier': 'source',
+    'name': 'readable_name',
+    'readable_name': 'readable_name',
+    'description': 'readable_name',
+}
+
+# the columns of a CSV file without a header
+DEFAULT_CSV_COLUMNS = ['number', 'source', 'readable_name']
+
+FORMATS = ('lines', 'csv', 'jsonl')
+
+
+def detect_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return 'csv'
+    if ext in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    return 'lines'
+
+
+def split_line(line: str) -> List[str]:
+    """
+    Split a line of the tracking file into whitespace separated tokens.
+
+    Tokens can be quoted with double quotes to contain whitespace, inside of
+    which \\" and \\\\ stand for a quote and a backslash.
+    """
+    if '"' not in line:
+        return line.split()
+    if '\\' not in line and line.count('"') % 2 == 0:
+        return _split_quoted(line)
+
+    tokens = []
+    token = []
+    quoted = False
+    in_token = False
+    chars = iter(line)
+    for char in chars:
+        if quoted:
+            if char == '\\':
+                char = next(chars, '')
+            elif char == '"':
+                quoted = False
+                continue
+            token.append(char)
+        elif char == '"':
+            quoted = in_token = True
+        elif char.isspace():
+            if in_token:
+                tokens.append(''.join(token))
+                token.clear()
+                in_token = False
+        else:
+            token.append(char)
+            in_token = True
+    if in_token:
+        tokens.append(''.join(token))
+    return tokens
+
+
+def _split_quoted(line: str) -> List[str]:
+    """
+    split_line for lines with balanced quotes and no escapes, without looking at every character
+    """
+    tokens = []
+    # whether the last token continues, because nothing separated it from what follows
+    joined = False
+    for i, part in enumerate(line.split('"')):
+        if i % 2:
+            if joined:
+                tokens[-1] += part
+            else:
+                tokens.append(part)
+            joined = True
+        elif part:
+            words = part.split()
+            if joined and words and not part[0].isspace():
+                tokens[-1] += words.pop(0)
+            tokens.extend(words)
+            joined = not part[-1].isspace()
+    return tokens
+
+
+def _identifier(number, source, readable_name) -> TrackingIdentifier:
+    if not isinstance(number, str) or not number:
+        raise ValueError("no tracking number")
+    return TrackingIdentifier(number, source=source or None, readable_name=readable_name or None)
+
+
+class TrackingFileParser:
+    """
+    Parses the lines of a tracking file in one of the FORMATS into TrackingIdentifiers:
+
+     - lines: `<number> <source> [<name>]`, separated by whitespace, see split_line
+     - csv: comma separated `number,source,name`, optionally with a header naming the
+       columns (see CSV_COLUMNS). Quoted fields can't span lines.
+     - jsonl: one object per line, with the keys number, source and name (or readable_name)
+
+    Lines are parsed one at a time, so a file can be streamed through it.
+    """
+    format: str
+
+    _csv_columns: Optional[List[Optional[str]]]
+
+    def __init__(self, format: str = 'lines'):
+        if format not in FORMATS:
+            raise ValueError("unknown tracking file format {!r}".format(format))
+        self.format = format
+        self._csv_columns = None
+
+    def is_header(self, line: str) -> bool:
+        """
+        check for a CSV header line, and remember its columns if it is one
+        """
+        if self.format != 'csv':
+            return False
+        try:
+            cells = [cell.strip().lower() for cell in next(csv.reader([line]), [])]
+        except csv.Error:
+            return False
+        if not cells or cells[0] not in CSV_COLUMNS:
+            return False
+        self._csv_columns = [CSV_COLUMNS.get(cell) for cell in cells]
+        return True
+
+    def parse(self, line: str) -> TrackingIdentifier:
+        """
+        :raises ValueError: if the line is malformed
+        """
+        if self.format == 'lines':
+            number, *info = split_line(line)
+            return _identifier(number, info[0] if info else None, info[1] if len(info) > 1 else None)
+
+        if self.format == 'jsonl':
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError("expected a JSON object")
+            return _identifier(data.get('number'), data.get('source'), data.get('name', data.get('readable_name')))
+
+        try:
+            cells = next(csv.reader([line]), [])
+        except csv.Error as e:
+            raise ValueError(str(e))
+        fields = dict(zip(self._csv_columns or DEFAULT_CSV_COLUMNS, (cell.strip() for cell in cells)))
+        return _identifier(fields.get('number'), fields.get('source'), fields.get('readable_name'))
+
+
+def read_tracking_file(path: str, known_sources: Container[str], cache: Dict[str, Optional[TrackingIdentifier]],
+                       format: Optional[str] = None, detect: bool = False) -> Iterator[TrackingIdentifier]:
+    """
+    Stream the packages of a tracking file.
+
+    Lines found in cache aren't parsed again. Once the file is read completely, cache
+    holds exactly its lines, with what they parsed to (None for invalid ones), ready
+    for the next read. Malformed lines and packages whose source isn't in known_sources
+    are logged and skipped, only the first time they are seen.
+
+    :param cache: maps lines to what they parsed to, updated in place
+    :param detect: rather than skipping packages without a (known) source, return them
+                   with source None, for the caller to detect the carrier
+    """
+    parser = TrackingFileParser(format or detect_format(path))
+    new_cache = dict()
+    with open(path, 'r', newline='' if parser.format == 'csv' else None) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            if line_number == 1 and parser.is_header(line):
+                continue
+            if line in cache:
+                id = cache[line]
+            else:
+                id = _parse_checked(parser, line, line_number, path, known_sources, detect)
+            new_cache[line] = id
+            if id is not None:
+                yield id
+    cache.clear()
+    cache.update(new_cache)
+
+
+def _parse_checked(parser: TrackingFileParser, line: str, line_number: int, path: str,
+                   known_sources: Container[str], detect: bool = False) -> Optional[TrackingIdentifier]:
+    try:
+        id = parser.parse(line)
+    except ValueError as e:
+        logger.error("{}:{}: skipping malformed line ({})".format(path, line_number, e))
+        return None
+    if id.source is None:
+        if detect:
+            return id
+        logger.error("{}:{}: skipping {}, it has no source".format(path, line_number, id.number))
+        return None
+    if id.source not in known_sources:
+        if detect:
+            logger.warning("{}:{}: unknown source {!r} for {}, telling the carrier from the number instead".format(
+                path, line_number, id.source, id.number))
+            return dataclasses.replace(id, source=None)
+        logger.error("{}:{}: skipping {}, unknown source {!r}".format(path, line_number, id.number, id.source))
+        return None
+    return id
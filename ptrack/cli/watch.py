@@ -1,17 +1,282 @@
+import asyncio
+import dataclasses
 import os
-import re
+import queue
+import threading
 import time
-from datetime import datetime
-from typing import Dict
+from collections import defaultdict
+from concurrent import futures
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging import getLogger
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple, Union
 
-import ptrack.cli.color as color
-import ptrack.cli.symbols as symbols
-from ptrack.modules import ALL_MODULES
-from ptrack.modules.models import TrackingState, TrackingSupplier, TrackingIdentifier, PackageState
+from ptrack.modules.detect import CarrierDetector, shared_detector
+from ptrack.modules.models import TrackingState, TrackingSupplier, TrackingIdentifier
+from ptrack.modules.metrics import METRICS
+from ptrack.modules.registry import ALL_MODULES, SupplierPool
+from ptrack.modules.transport import CarrierUnavailable
+from .filewatch import InotifyFileWatcher, StatFileWatcher, file_watcher_for
+from .render import PENDING, STALE, Marks, Renderer, Tracks
+from .schedule import PollScheduler
+from .store import StateStore
+from .throttle import CircuitBreaker, ConcurrencyLimit, TokenBucket
+from .trackfile import read_tracking_file
 
+logger = getLogger(__name__)
 
-def _file_line_split(line: str):
-    return [x[0].strip('"') for x in re.findall(r'("(\\"|[^"\\])+"|[^\s]+)', line)]
+# the result of a shared lookup that failed or was skipped
+_MISSING = object()
+
+
+class RefreshEngine:
+    """
+    Fetches the state of many packages concurrently.
+
+    Packages are grouped by carrier and split into chunks of the suppliers batch_size.
+    Every chunk is one lookup, with at most max_concurrency lookups in flight overall
+    and at most carrier_concurrency[source] (or default_carrier_concurrency) in flight
+    for a single carrier. A rescan therefore takes about as long as the slowest lookup
+    instead of the sum of all of them.
+
+    Lookups at each carrier are also limited to rate_limits[source] (or
+    default_rate_limit) per second. A carrier that times out, refuses connections
+    or answers 429/5xx is skipped for a while by its circuit breaker, so its packages
+    keep their last known state and the other carriers don't wait for it.
+
+    Each tracking number is looked up once per carrier, however many ids (e.g. with
+    different names) it is listed under, and refreshes running at the same time share
+    their lookups. A finished lookup also answers further requests for the same number
+    for result_ttl seconds, e.g. a file reload right after a rescan.
+    """
+    trackers: Mapping[str, TrackingSupplier]
+
+    max_concurrency: int
+    carrier_concurrency: Dict[str, int]
+    default_carrier_concurrency: int
+    rate_limits: Dict[str, float]
+    default_rate_limit: float
+    # seconds a finished lookup is shared with later refreshes, 0 to only share lookups in flight
+    result_ttl: float
+
+    # run on every worker thread as it starts, e.g. to profile lookups
+    thread_initializer: Optional[Callable[[], None]] = None
+
+    _buckets: Dict[str, TokenBucket]
+    _breakers: Dict[str, CircuitBreaker]
+    # shared by all refreshes, which run on several threads at once
+    _global_limit: ConcurrencyLimit
+    _carrier_limits: Dict[str, ConcurrencyLimit]
+
+    # lookups in flight, or finished less than result_ttl ago, by source and number
+    _flights: Dict[Tuple[str, str], Future]
+    # when the finished ones among them expire, in time.monotonic()
+    _flight_expiry: Dict[Tuple[str, str], float]
+    # the states handed out for ids that shared a lookup with another id, with the
+    # state they are a copy of, so an unchanged state stays the same object
+    _copies: Dict[TrackingIdentifier, Tuple[TrackingState, TrackingState]]
+
+    def __init__(self, trackers: Mapping[str, TrackingSupplier], max_concurrency: int = 64,
+                 carrier_concurrency: Optional[Dict[str, int]] = None, default_carrier_concurrency: int = 16,
+                 rate_limits: Optional[Dict[str, float]] = None, default_rate_limit: float = 10,
+                 result_ttl: float = 5):
+        self.trackers = trackers
+        self.max_concurrency = max_concurrency
+        self.carrier_concurrency = dict(carrier_concurrency or {})
+        self.default_carrier_concurrency = default_carrier_concurrency
+        self.rate_limits = dict(rate_limits or {})
+        self.default_rate_limit = default_rate_limit
+        self.result_ttl = result_ttl
+        self._buckets = dict()
+        self._breakers = dict()
+        self._global_limit = ConcurrencyLimit(max_concurrency)
+        self._carrier_limits = dict()
+        # guards creating the per carrier limits, buckets and breakers
+        self._carriers_lock = threading.Lock()
+        self._flights = dict()
+        self._flight_expiry = dict()
+        self._flights_lock = threading.Lock()
+        self._copies = dict()
+
+    def bucket_for(self, source: str) -> TokenBucket:
+        with self._carriers_lock:
+            if source not in self._buckets:
+                self._buckets[source] = TokenBucket(self.rate_limits.get(source, self.default_rate_limit))
+            return self._buckets[source]
+
+    def breaker_for(self, source: str) -> CircuitBreaker:
+        with self._carriers_lock:
+            if source not in self._breakers:
+                self._breakers[source] = CircuitBreaker(source)
+            return self._breakers[source]
+
+    def limit_for(self, source: str) -> ConcurrencyLimit:
+        with self._carriers_lock:
+            if source not in self._carrier_limits:
+                self._carrier_limits[source] = ConcurrencyLimit(
+                    self.carrier_concurrency.get(source, self.default_carrier_concurrency))
+            return self._carrier_limits[source]
+
+    def refresh(self, ids: Iterable[TrackingIdentifier]) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        """
+        Fetch the state of all given packages and wait for the results.
+
+        Lookups that failed with an exception, or were skipped because their carrier is
+        unhealthy, are missing from the result, so callers can keep whatever state they
+        knew before.
+        """
+        ids = list(ids)
+        if not ids:
+            return {}
+        return asyncio.run(self.refresh_async(ids))
+
+    async def refresh_async(self, ids: Iterable[TrackingIdentifier]) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        by_key: Dict[Tuple[str, str], List[TrackingIdentifier]] = defaultdict(list)
+        for id in ids:
+            by_key[id.source, id.number].append(id)
+        owned, joined = self._join_flights(by_key)
+        for (source, number), key_ids in by_key.items():
+            # all ids but the one the lookup is done for
+            coalesced = len(key_ids) - ((source, number) in owned)
+            if coalesced:
+                METRICS.inc('ptrack_lookups_total', coalesced, carrier=source, outcome='coalesced')
+
+        fetched = dict()
+        try:
+            if owned:
+                fetched = await self._fetch_all([by_key[key][0] for key in owned])
+        finally:
+            self._land({key: fetched.get(by_key[key][0], _MISSING) for key in owned}, owned)
+        shared = {key: await asyncio.wrap_future(future) for key, future in joined.items()}
+
+        results = dict()
+        for key, key_ids in by_key.items():
+            state = fetched.get(key_ids[0], _MISSING) if key in owned else shared[key]
+            if state is _MISSING:
+                continue
+            for id in key_ids:
+                results[id] = self._share(state, id)
+        return results
+
+    def _join_flights(self, keys: Iterable[Tuple[str, str]]) -> Tuple[Dict[Tuple[str, str], Future],
+                                                                       Dict[Tuple[str, str], Future]]:
+        """
+        :return: the lookups the caller has to do and finish with _land(), and the lookups
+                 of other refreshes it can wait for instead
+        """
+        owned, joined = dict(), dict()
+        now = time.monotonic()
+        with self._flights_lock:
+            for key in [key for key, expiry in self._flight_expiry.items() if expiry <= now]:
+                del self._flight_expiry[key]
+                del self._flights[key]
+            for key in keys:
+                if key in self._flights:
+                    joined[key] = self._flights[key]
+                else:
+                    owned[key] = self._flights[key] = Future()
+        return owned, joined
+
+    def _land(self, states: Dict[Tuple[str, str], object], owned: Dict[Tuple[str, str], Future]):
+        """
+        hand the results of our own lookups to whoever joined them, failed ones aren't kept
+        """
+        expiry = time.monotonic() + self.result_ttl
+        with self._flights_lock:
+            for key, state in states.items():
+                if state is _MISSING or self.result_ttl <= 0:
+                    del self._flights[key]
+                else:
+                    self._flight_expiry[key] = expiry
+        for key, future in owned.items():
+            future.set_result(states[key])
+
+    def _share(self, state: Optional[TrackingState], id: TrackingIdentifier) -> Optional[TrackingState]:
+        """
+        state, for id. A copy made for an earlier, identical state is handed out again.
+        """
+        if state is None or state.id == id:
+            return state
+        with self._flights_lock:
+            original, copy = self._copies.get(id, (None, None))
+            if original is not state:
+                copy = dataclasses.replace(state, id=id)
+                self._copies[id] = (state, copy)
+            return copy
+
+    async def _fetch_all(self, ids: List[TrackingIdentifier]) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        loop = asyncio.get_running_loop()
+        # sync suppliers are adapted through the default executor, so it has to be
+        # large enough to not become the bottleneck itself
+        loop.set_default_executor(ThreadPoolExecutor(self.max_concurrency, thread_name_prefix='ptrack-refresh',
+                                                     initializer=self.thread_initializer))
+
+
+        async def fetch(source: str, chunk: List[TrackingIdentifier]) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+            breaker = self.breaker_for(source)
+            async with self.limit_for(source):
+                # checked as late as possible, earlier lookups may have just opened it
+                if not breaker.allow():
+                    METRICS.inc('ptrack_lookups_total', len(chunk), carrier=source, outcome='skipped')
+                    return {}
+                await asyncio.sleep(self.bucket_for(source).reserve())
+                async with self._global_limit:
+                    try:
+                        result = await self.lookup(source, chunk)
+                    except OSError as e:
+                        # timeouts, connection errors and 429/5xx: the carrier, not the package
+                        logger.error("Error fetching {} from {}: {}".format(
+                            ", ".join(id.number for id in chunk), source, e
+                        ))
+                        breaker.failure(isinstance(e, CarrierUnavailable), getattr(e, 'retry_after', None))
+                        return {}
+                    except Exception:
+                        logger.exception("Error fetching {} from {}:".format(
+                            ", ".join(id.number for id in chunk), source
+                        ))
+                        breaker.success()
+                        return {}
+                    breaker.success()
+                    return result
+
+        results = await asyncio.gather(*(
+            fetch(source, chunk) for source, chunk in self._chunks(ids)
+        ))
+        return {id: state for result in results for id, state in result.items()}
+
+    async def lookup(self, source: str, chunk: List[TrackingIdentifier]) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        """
+        look up one chunk of packages of a single carrier
+        """
+        tracker = self.trackers[source]
+        if len(chunk) == 1:
+            return {chunk[0]: await tracker.get_details_for_async(chunk[0])}
+        return await tracker.get_details_for_many_async(chunk)
+
+    def forget(self, ids: List[TrackingIdentifier]):
+        """
+        drop what is remembered about packages that are no longer watched
+        """
+        with self._flights_lock:
+            for id in ids:
+                self._copies.pop(id, None)
+
+    def close(self):
+        """
+        stop any workers the engine started
+        """
+        pass
+
+    def _chunks(self, ids: List[TrackingIdentifier]) -> Iterator[Tuple[str, List[TrackingIdentifier]]]:
+        """
+        group ids by their source and split them into chunks of the carriers batch_size
+        """
+        by_source: Dict[str, List[TrackingIdentifier]] = defaultdict(list)
+        for id in ids:
+            by_source[id.source].append(id)
+        for source, source_ids in by_source.items():
+            size = max(self.trackers[source].batch_size, 1)
+            for i in range(0, len(source_ids), size):
+                yield source, source_ids[i:i + size]
 
 
 class PackageWatcher:
@@ -21,164 +286,507 @@ class PackageWatcher:
     It reads a number of tracking infos from a file and periodically checks their status
 
     It also checks the file for changes and adds or removes trackers based on its content
-    """
-    RESCAN_INTERVAL = 60 * 20  # 20 minute interval scan
 
-    trackers = dict[str, TrackingSupplier]
+    With a deadline, lookups run on background threads and a tick waits for them at
+    most deadline seconds before rendering what is known, so slow carriers never hold
+    up the output. Packages whose lookup is still running are marked as PENDING (never
+    fetched) or STALE (their refresh is overdue), and their results are picked up by a
+    later tick, wait() returns as soon as they arrive. Without a deadline, every tick
+    waits for all of its lookups.
+
+    Packages listed without a (known) source get their carrier from the format of their
+    number, see ptrack.modules.detect. If several carriers use that format, they are
+    asked in the background, one after another, and the package shows up once one of
+    them knows it. Numbers none of them know yet are asked about again after the
+    scheduler's UNKNOWN_INTERVAL, only a carrier that knew the package is remembered.
+    """
+    # suppliers are imported and created when the first package of their source shows up
+    trackers: SupplierPool
 
     tracks: Dict[TrackingIdentifier, TrackingState]
-    last_scan: float
+    fetched_at: Dict[TrackingIdentifier, float]
     last_file_version: float
 
+    # every line of the file as of the last load, with what it parsed to (None if invalid)
+    _line_cache: Dict[str, Optional[TrackingIdentifier]]
+
     source_file_name: str
 
     display_mode: str
+    renderer: Renderer
+
+    engine: RefreshEngine
+    scheduler: PollScheduler
+    store: Optional[StateStore]
+    file_watcher: Union[InotifyFileWatcher, StatFileWatcher]
 
-    def __init__(self, source: str, display_mode='compact'):
+    # seconds a tick waits for lookups, None to wait until they are done
+    deadline: Optional[float]
+    # how often the file is checked while wait() waits for lookups in flight
+    pending_poll_interval: float = 0.25
+
+    # lookups running in the background, with the packages they are for
+    _pending: Dict[Future, List[TrackingIdentifier]]
+    _in_flight: Set[TrackingIdentifier]
+    # the work queued for the background thread of each carrier
+    _lanes: Dict[str, 'queue.Queue[Tuple[Future, Callable[[], Any]]]']
+
+    # built the first time a package without a source shows up, it imports all carriers
+    detector: Optional[CarrierDetector]
+    # the carrier of every number listed without one, once it is known
+    _detected: Dict[str, str]
+    # the carriers numbers with more than one candidate could belong to, [] if there are none
+    _candidates: Dict[str, List[str]]
+    # the packages of the file whose carrier isn't known yet, by number
+    _unresolved: Dict[str, TrackingIdentifier]
+    # the carriers being asked in the background, see _probe
+    _probing: Dict[Future, List[str]]
+    _probing_numbers: Set[str]
+    # when numbers no carrier knew yet are asked about again
+    _probe_due: Dict[str, float]
+
+    def __init__(self, source: str, display_mode='compact', max_concurrency: int = 64,
+                 carrier_concurrency: Optional[Dict[str, int]] = None, store: Optional[StateStore] = None,
+                 scheduler: Optional[PollScheduler] = None, poll_interval: float = 1,
+                 rate_limits: Optional[Dict[str, float]] = None, shards: int = 0, deadline: Optional[float] = None):
         self.tracks = dict()
-        self.last_scan = 0
+        self.fetched_at = dict()
         self.last_file_version = 0
+        self._line_cache = dict()
         self.source_file_name = source
         self.display_mode = display_mode
+        self.renderer = Renderer(display_mode)
+        self.store = store
+        self.scheduler = scheduler or PollScheduler()
+        self.deadline = deadline
+        self._pending = dict()
+        self._in_flight = set()
+        self._lanes = dict()
+        self.detector = None
+        self._detected = dict()
+        self._candidates = dict()
+        self._unresolved = dict()
+        self._probing = dict()
+        self._probing_numbers = set()
+        self._probe_due = dict()
 
-        self.trackers = {
-            name: cls(config_cls())
-            for name, (cls, config_cls) in ALL_MODULES.items()
-        }
+        self.trackers = SupplierPool(ALL_MODULES)
+        if shards > 1:
+            # imported here, it pulls in multiprocessing
+            from .shard import ShardedRefreshEngine
+            self.engine = ShardedRefreshEngine(self.trackers, shards, max_concurrency=max_concurrency,
+                                               carrier_concurrency=carrier_concurrency, rate_limits=rate_limits)
+        else:
+            self.engine = RefreshEngine(self.trackers, max_concurrency, carrier_concurrency, rate_limits=rate_limits)
+        self.file_watcher = file_watcher_for(source, poll_interval)
 
         self.tracks = self.load_file()
+        if deadline is None:
+            self.tracks.update(self.collect(self.tracks))
+            self.tracks.update(self.collect_detected(None))
 
     def load_file(self):
         """
-        load tracking numbers from a file and fetch their statuses if no local
-        cache exists for them.
+        load tracking numbers from a file and start fetching the statuses of new packages,
+        their results are picked up by collect().
 
-        :return: A new dictionary of trackers
+        Packages that were already loaded keep their state, packages that were only
+        renamed keep their state under the new name. Packages we don't know yet are
+        first looked up in the persistent store, and only fetched if their stored
+        status is already due for a refresh.
+
+        :return: A new dictionary of trackers, or the current one if the file is
+                 missing, e.g. while an editor replaces it
         """
-        with open(self.source_file_name, 'r') as f:
-            data = {
-                _file_line_split(line)[0]: _file_line_split(line)[1:] for line in f if line.strip()
-            }
+        ids = self._read_file()
+        if ids is None:
+            return self.tracks
+        ids = self._resolve_sources(ids)
+        known = {(id.number, id.source): id for id in self.tracks}
         new_tracks = dict()
-        must_rescan = self.should_rescan()
-        for id, info in data.items():
-            id = TrackingIdentifier(id, source=info[0], readable_name=info[1] if len(info) > 1 else None)
-            if must_rescan or id not in self.tracks:
-                new_tracks[id] = self.trackers[id.source].get_details_for(id)
-            else:
+        added = []
+        for id in ids:
+            old = known.get((id.number, id.source))
+            if old == id:
                 new_tracks[id] = self.tracks[id]
-        if must_rescan:
-            self.last_scan = time.time()
-        self.last_file_version = os.stat(self.source_file_name).st_mtime
+            elif old is not None:
+                # only the readable name changed
+                state = self.tracks[old]
+                new_tracks[id] = dataclasses.replace(state, id=id) if state is not None else None
+                if old in self.fetched_at:
+                    self.fetched_at[id] = self.fetched_at.pop(old)
+                if old in self._in_flight:
+                    # the result will arrive for the old id and is dropped
+                    self.scheduler.schedule_now(id)
+                else:
+                    self.scheduler.rename(old, id)
+            else:
+                added.append(id)
+
+        stored = self.store.load(added) if self.store is not None else {}
+        for id in added:
+            if id in stored:
+                self.fetched_at[id], new_tracks[id] = stored[id]
+                self.scheduler.schedule(id, new_tracks[id], self.fetched_at[id])
+            else:
+                new_tracks[id] = None
+                self.scheduler.schedule_now(id)
+        removed = list(self.tracks.keys() - new_tracks.keys())
+        for id in removed:
+            self.scheduler.remove(id)
+            self.fetched_at.pop(id, None)
+        self.engine.forget(removed)
+
+        self.start_refresh(self.scheduler.pop_due())
         return new_tracks
 
+    def _read_file(self) -> Optional[Iterable[TrackingIdentifier]]:
+        """
+        read the tracking file, only parsing lines that weren't there at the last load.
+        Packages without a (known) source have source None.
+
+        :return: the packages, or None if the file doesn't exist (right now)
+        """
+        by_number = dict()
+        try:
+            version = os.stat(self.source_file_name).st_mtime
+            for id in read_tracking_file(self.source_file_name, self.trackers, self._line_cache, detect=True):
+                by_number[id.number] = id
+        except FileNotFoundError:
+            # editors like vim save by moving the file away and writing a new one
+            logger.debug("{} is gone, waiting for it to come back".format(self.source_file_name))
+            return None
+        self.last_file_version = version
+        return by_number.values()
+
+    def _resolve_sources(self, ids: Iterable[TrackingIdentifier]) -> List[TrackingIdentifier]:
+        """
+        Fill in the source of packages listed without one, if it is known already or the
+        number only fits one carrier. Packages that could belong to several carriers are
+        left out, and their carriers are asked in the background, see collect_detected().
+        """
+        ids = list(ids)
+        self._detect([id for id in ids if id.source is None and id.number not in self._detected
+                      and id.number not in self._candidates])
+
+        resolved = []
+        self._unresolved = dict()
+        for id in ids:
+            if id.source is not None:
+                resolved.append(id)
+            elif id.number in self._detected:
+                resolved.append(dataclasses.replace(id, source=self._detected[id.number]))
+            elif self._candidates[id.number]:
+                self._unresolved[id.number] = id
+        # numbers removed from the file are asked about from scratch if they come back
+        self._probe_due = {number: due for number, due in self._probe_due.items() if number in self._unresolved}
+        self._start_due_probes()
+        return resolved
+
+    def _start_due_probes(self):
+        """
+        start asking the candidates of unresolved packages that aren't being asked already
+        and aren't waiting to be asked again
+        """
+        now = time.time()
+        probe = {id: self._candidates[number] for number, id in self._unresolved.items()
+                 if number not in self._probing_numbers and self._probe_due.get(number, 0) <= now}
+        if probe:
+            self._start_probe(probe)
+
+    def _next_probe(self) -> Optional[float]:
+        """
+        when the next unresolved package is asked about again, if any is waiting for that
+        """
+        return min((self._probe_due.get(number, 0) for number in self._unresolved
+                    if number not in self._probing_numbers), default=None)
+
+    def _detect(self, ids: List[TrackingIdentifier]):
+        """
+        Tell the carriers of packages from their numbers, without asking any of them.
+        Where several carriers fit, the store decides if one of them already knew
+        the package.
+        """
+        if not ids:
+            return
+        if self.detector is None:
+            self.detector = shared_detector()
+        ambiguous = []
+        for id in ids:
+            candidates = self.detector.candidates(id.number)
+            if len(candidates) == 1:
+                logger.info("{} looks like a number of {}".format(id.number, candidates[0]))
+                self._detected[id.number] = candidates[0]
+                continue
+            if not candidates:
+                logger.error("skipping {}, it has no source and doesn't look like the number of any carrier"
+                             .format(id.number))
+            else:
+                ambiguous.append(id)
+            self._candidates[id.number] = candidates
+
+        if ambiguous and self.store is not None:
+            stored = self.store.load(dataclasses.replace(id, source=source)
+                                     for id in ambiguous for source in self._candidates[id.number])
+            for id in ambiguous:
+                found = [source for source in self._candidates[id.number]
+                         if stored.get(dataclasses.replace(id, source=source), (None, None))[1] is not None]
+                if found:
+                    self._detected[id.number] = found[0]
+
+    def _start_probe(self, candidates: Dict[TrackingIdentifier, List[str]]):
+        future = Future()
+        numbers = [id.number for id in candidates]
+        self._probing[future] = numbers
+        self._probing_numbers.update(numbers)
+        self._submit('detect', future, lambda: self._probe(candidates))
+
+    def _probe(self, candidates: Dict[TrackingIdentifier, List[str]]) \
+            -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        """
+        Ask the candidate carriers of packages for them, in order, until one knows them.
+        All packages are asked at their next carrier at once, so there are only as many
+        rounds as a number has candidates.
+
+        :return: the state of the packages a carrier knew, under the id with that carrier
+        """
+        found = dict()
+        remaining = {id: list(sources) for id, sources in candidates.items()}
+        while remaining:
+            attempts = {dataclasses.replace(id, source=sources.pop(0)): id for id, sources in remaining.items()}
+            fetched = self.engine.refresh(list(attempts))
+            for attempt, id in attempts.items():
+                if fetched.get(attempt) is not None:
+                    found[attempt] = fetched[attempt]
+                elif remaining[id]:
+                    continue
+                del remaining[id]
+        return found
+
+    def collect_detected(self, timeout: Optional[float] = None) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        """
+        Wait up to timeout seconds for carriers being asked for packages without a source,
+        persist and schedule the packages that were found. Packages no carrier knew are
+        asked about again later.
+
+        :return: the packages that were found and are still in the file, with their state
+        """
+        if not self._probing:
+            return {}
+        done, _ = futures.wait(list(self._probing), timeout)
+        now = time.time()
+        added = dict()
+        for future in done:
+            numbers = self._probing.pop(future)
+            self._probing_numbers.difference_update(numbers)
+            try:
+                found = future.result()
+            except Exception:
+                logger.exception("Error detecting carriers:")
+                found = {}
+            unknown = set(numbers) - {probed.number for probed in found}
+            for number in unknown:
+                self._probe_due[number] = now + self.scheduler.UNKNOWN_INTERVAL
+                if number in self._unresolved:
+                    logger.warning("none of {} know {} yet, asking again in {:.0f} minutes".format(
+                        ", ".join(self._candidates[number]), number, self.scheduler.UNKNOWN_INTERVAL / 60))
+            for probed, state in found.items():
+                self._probe_due.pop(probed.number, None)
+                self._detected[probed.number] = probed.source
+                if probed.number not in self._unresolved:
+                    continue
+                # the name may have changed in the meantime
+                id = dataclasses.replace(self._unresolved.pop(probed.number), source=probed.source)
+                added[id] = dataclasses.replace(state, id=id) if state.id != id else state
+                self.fetched_at[id] = now
+                self.scheduler.schedule(id, added[id], now)
+        if self.store is not None:
+            self.store.save(added, now)
+        return added
+
+    def refresh(self, ids: Iterable[TrackingIdentifier], known: Dict[TrackingIdentifier, TrackingState]) \
+            -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        """
+        fetch the status of the given packages and wait for them, see collect()
+        """
+        self.start_refresh(ids)
+        return self.collect(known)
+
+    def start_refresh(self, ids: Iterable[TrackingIdentifier]):
+        """
+        Start fetching the status of the given packages in the background.
+
+        Every carrier has its own background thread, so the results of fast carriers
+        don't wait for slow ones. Concurrency and rate limits are shared by all of
+        them, so max_concurrency still holds for all carriers together.
+        """
+        by_source: Dict[str, List[TrackingIdentifier]] = defaultdict(list)
+        for id in ids:
+            by_source[id.source].append(id)
+        for source, source_ids in by_source.items():
+            future = Future()
+            self._pending[future] = source_ids
+            self._in_flight.update(source_ids)
+            self._submit(source, future, lambda source_ids=source_ids: self.engine.refresh(source_ids))
+
+    def _submit(self, lane: str, future: Future, work: Callable[[], Any]):
+        """
+        run work on the background thread of lane, after whatever was queued there before
+        """
+        if lane not in self._lanes:
+            self._lanes[lane] = queue.Queue()
+            threading.Thread(target=self._background_refresh, args=(self._lanes[lane],),
+                             name='ptrack-background-{}'.format(lane), daemon=True).start()
+        self._lanes[lane].put((future, work))
+
+    def _background_refresh(self, lane: 'queue.Queue[Tuple[Future, Callable[[], Any]]]'):
+        while True:
+            future, work = lane.get()
+            try:
+                future.set_result(work())
+            except BaseException as e:
+                future.set_exception(e)
+
+    def collect(self, known: Dict[TrackingIdentifier, Optional[TrackingState]], timeout: Optional[float] = None) \
+            -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        """
+        Wait up to timeout seconds (None for as long as it takes) for the lookups in flight,
+        persist their results and schedule the next refresh of their packages.
+
+        :return: only the states that changed. Suppliers hand back the very same
+                 state object if the carriers response didn't change, those are left
+                 out just like failed lookups, which get rescheduled based on their
+                 last known state. Results for packages that aren't in known (anymore)
+                 are dropped.
+        """
+        if not self._pending:
+            return {}
+        done, _ = futures.wait(list(self._pending), timeout)
+        changed = dict()
+        for future in done:
+            ids = self._pending.pop(future)
+            self._in_flight.difference_update(ids)
+            try:
+                fetched = future.result()
+            except Exception:
+                logger.exception("Error refreshing {} packages:".format(len(ids)))
+                fetched = {}
+            changed.update(self._apply(ids, fetched, known))
+        return changed
+
+    def _apply(self, ids: List[TrackingIdentifier], fetched: Dict[TrackingIdentifier, Optional[TrackingState]],
+               known: Dict[TrackingIdentifier, Optional[TrackingState]]) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        now = time.time()
+        for id in ids:
+            if id in known:
+                self.fetched_at[id] = now
+                self.scheduler.schedule(id, fetched[id] if id in fetched else known[id], now)
+
+        changed = {id: state for id, state in fetched.items() if id in known and state is not known[id]}
+        if self.store is not None:
+            self.store.save(changed, now)
+            self.store.touch({id for id in fetched if id in known} - changed.keys(), now)
+        return changed
+
+    def marks(self) -> Marks:
+        """
+        the packages whose lookup is still running, PENDING if they were never fetched
+        and STALE if they are shown with their last known state
+        """
+        return {id: STALE if id in self.fetched_at else PENDING for id in self._in_flight if id in self.tracks}
+
     def should_rescan(self) -> bool:
         """
-        check if the cached results are no older than RESCAN_INTERVAL seconds
+        check if any package is due for a refresh
         """
-        return self.last_scan + self.RESCAN_INTERVAL < time.time()
+        next_due = self.scheduler.next_due()
+        return next_due is not None and next_due <= time.time()
 
     def file_changed(self) -> bool:
         """
-        check if the file has changed
-        :return:
+        check if the file has changed. A missing file, e.g. while an editor replaces it,
+        hasn't changed (yet).
+        """
+        try:
+            last_mod = os.stat(self.source_file_name).st_mtime
+        except FileNotFoundError:
+            return False
+        return last_mod != self.last_file_version
+
+    def wait(self):
+        """
+        Block until the file changed, the next package is due for a refresh or a
+        lookup in flight finished.
+
+        Call this between ticks instead of sleeping.
         """
-        last_mod = os.stat(self.source_file_name).st_mtime
-        if last_mod != self.last_file_version:
-            return True
+        next_due = min((due for due in (self.scheduler.next_due(), self._next_probe()) if due is not None),
+                       default=None)
+        timeout = max(next_due - time.time(), 0) if next_due is not None else None
+        if not self._pending and not self._probing:
+            self.file_watcher.wait(timeout)
+            return
 
-    def tick(self):
+        # the file watcher can't be woken up by finished lookups, so it is only checked in between
+        until = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            step = self.pending_poll_interval
+            if until is not None:
+                step = min(step, max(until - time.monotonic(), 0))
+            done, _ = futures.wait([*self._pending, *self._probing], step, return_when=futures.FIRST_COMPLETED)
+            if done or self.file_watcher.wait(0):
+                return
+            if until is not None and time.monotonic() >= until:
+                return
+
+    def tick(self) -> Optional[str]:
         """
         This represents one update action. It should be called periodically.
+
+        :return: the rendered output, or None if it didn't change
+        """
+        old_tracks, new_tracks = self.update()
+        with METRICS.timer('ptrack_tick_phase_seconds', phase='render'):
+            return self.renderer.render(old_tracks, new_tracks, self.marks())
+
+    def update(self) -> Tuple[Tracks, Tracks]:
+        """
+        reload the file if it changed, or refresh the packages that are due, and
+        pick up the results of lookups that finish before the deadline.
+
+        :return: the tracks before and after the update. If nothing changed, both are
+                 the very same dict.
         """
-        if self.file_changed():
-            new_tracks = self.load_file()
-        elif self.should_rescan():
-            new_tracks = {
-                id: self.trackers[id.source].get_details_for(id)
-                for id in self.tracks
-            }
-            self.last_scan = time.time()
+        started = time.monotonic()
+        with METRICS.timer('ptrack_tick_phase_seconds', phase='file_check'):
+            file_changed = self.file_changed()
+            rescan = not file_changed and self.should_rescan()
+
+        if file_changed:
+            with METRICS.timer('ptrack_tick_phase_seconds', phase='load_file'):
+                new_tracks = self.load_file()
         else:
             new_tracks = self.tracks
+            if rescan:
+                self.start_refresh(self.scheduler.pop_due())
+            self._start_due_probes()
 
-        output = self.print_diff(new_tracks)
-        self.tracks = new_tracks
-        return output
-
-    def print_diff(self, new_tracks):
-        if self.display_mode == 'compact':
-            return self.print_diff_compact(new_tracks)
-        elif self.display_mode == 'i3bar':
-            return self.print_diff_i3bar(new_tracks)
-        elif self.display_mode == 'exhaustive':
-            return self.print_exhaustive(new_tracks)
-
-        return self.print_diff_compact(new_tracks)
-
-    def print_diff_compact(self, new_tracks: Dict[TrackingIdentifier, TrackingState]):
-        removed = set(self.tracks.keys()) - set(new_tracks.keys())
-        added = set(new_tracks.keys()) - set(self.tracks.keys())
-
-        all_tracks: Dict[TrackingIdentifier, TrackingState] = {
-            **self.tracks,
-            **new_tracks
-        }
-        print("\033[H\033[2J", end="")
-        id: TrackingIdentifier
-        for id in sorted(all_tracks.keys(), key=lambda id: id.number):
-            info = all_tracks[id]
-            if info is None:
-                print("{}: not found".format(id.readable_name or id.number))
-                continue
-            print("{}{:<20}: {} {} {}{} {}{}".format(
-                color.RED if id in removed else (color.GREEN if id in added else ""),
-                id.readable_name or id.number,
-                print_date_time(info.last_update),
-                generate_progress_bar(*info.progress),
-                get_icon_for(info.state),
-                (" " + info.updates[0].where + ',') if len(info.updates) > 0 and info.updates[0].where else "",
-                info.short_description,
-                color.RESET
-            ))
-
-    def print_diff_i3bar(self, new_tracks: Dict[TrackingIdentifier, TrackingState]):
-        return " | ".join(
-            "{}: {} {}".format(
-                id.readable_name or id.number,
-                generate_progress_bar(*info.progress),
-                get_icon_for(info.state)
-            ) for id, info in new_tracks.items() if info is not None
-        )
-
-    def print_exhaustive(self, new_tracks: Dict[TrackingIdentifier, TrackingState]):
-        for id, info in new_tracks.items():
-            print("\n")
-            if info is None:
-                print("Nothing for {}".format(id))
-            else:
-                print(info.pretty_print())
-
-def generate_progress_bar(at: int, ttl: int):
-    return ('█' * at) + ('░' * (ttl - at))
-
-
-def print_date_time(dt: datetime):
-    if dt < datetime(2000, 1, 1, tzinfo=dt.tzinfo):
-        return "??.??. ??:??"
-    return dt.strftime('%d.%m. %H:%M')
-
-def get_icon_for(state: PackageState):
-    if state == PackageState.ANNOUNCED:
-        return symbols.MEGAPHONE
-    if state in (PackageState.ARRIVED_AT_INGRES, PackageState.ON_THE_WAY, PackageState.ARRIVED_AT_DESTINATION):
-        return symbols.SHIPPING_TRUCK
-    if state == PackageState.OUT_FOR_DELIVERY:
-        return symbols.DELIVERY_TRUCK
-    if state == PackageState.DELIVERED:
-        return symbols.CHECKMARK_BOX
-    if state == PackageState.CUSTOMS:
-        return symbols.CUSTOMS
-    if state == PackageState.READY_FOR_COLLECTION:
-        return symbols.POSTAL_HORN
-    return symbols.QUESTION_MARK
\ No newline at end of file
+        if self._pending or self._probing:
+            timeout = max(self.deadline - (time.monotonic() - started), 0) if self.deadline is not None else None
+            with METRICS.timer('ptrack_tick_phase_seconds', phase='refresh'):
+                futures.wait([*self._pending, *self._probing], timeout)
+                changed = {**self.collect(new_tracks, 0), **self.collect_detected(0)}
+            # keep the same dict if nothing changed, so rendering can be skipped entirely
+            if changed:
+                new_tracks = {**new_tracks, **changed}
+
+        old_tracks, self.tracks = self.tracks, new_tracks
+        return old_tracks, new_tracks
+
+    def print_diff(self, new_tracks) -> Optional[str]:
+        """
+        render the new tracks in the current display mode
+
+        :return: the output, or None if it didn't change since the last call
+        """
+        return self.renderer.render(self.tracks, new_tracks, self.marks())
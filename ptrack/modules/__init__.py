@@ -1,12 +1,34 @@
 from .models import TrackingIdentifier, TrackingState, TrackingSupplier, TrackingUpdateItem, IsDataclass, PackageState
-from .dhl_de import DHL_DE_Config, DHL_DE
-from .asendia import AsendiaConfig, AsendiaTracking
-from .gls import GLS_Config, GLS
-from .globalpost import GlobalPostTracking, GlobalPostSettings
-
-ALL_MODULES = {
-    'dhl': (DHL_DE, DHL_DE_Config),
-    'asendia': (AsendiaTracking, AsendiaConfig),
-    'globalpost': (GlobalPostTracking, GlobalPostSettings),
-    'gls': (GLS, GLS_Config)
+from .registry import ALL_MODULES, CarrierRegistry, SupplierPool
+
+# the carriers and the transport pull in requests, lxml and friends, so they are
+# only imported once they are actually used
+_LAZY_EXPORTS = {
+    'Transport': '.transport',
+    'TransportConfig': '.transport',
+    'shared_transport': '.transport',
+    'configure_shared_transport': '.transport',
+    'CarrierUnavailable': '.transport',
+    'DHL_DE_Config': '.dhl_de',
+    'DHL_DE': '.dhl_de',
+    'AsendiaConfig': '.asendia',
+    'AsendiaTracking': '.asendia',
+    'GLS_Config': '.gls',
+    'GLS': '.gls',
+    'GlobalPostTracking': '.globalpost',
+    'GlobalPostSettings': '.globalpost',
 }
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_EXPORTS:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    import importlib
+    return getattr(importlib.import_module(_LAZY_EXPORTS[name], __name__), name)
+
+
+__all__ = [
+    'TrackingIdentifier', 'TrackingState', 'TrackingSupplier', 'TrackingUpdateItem', 'IsDataclass', 'PackageState',
+    'ALL_MODULES', 'CarrierRegistry', 'SupplierPool',
+    *_LAZY_EXPORTS,
+]
@@ -0,0 +1,157 @@
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Iterable, List, Optional, Tuple, Union, TYPE_CHECKING
+
+from .cache import content_digest
+
+if TYPE_CHECKING:
+    from .models import TrackingIdentifier
+
+logger = getLogger(__name__)
+
+
+def default_archive_path() -> str:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'ptrack', 'archive')
+
+
+@dataclass(frozen=True)
+class ArchiveEntry:
+    """
+    A response as it was handed to a suppliers parser, see TrackingSupplier.parse_raw
+    """
+    carrier: str
+    # the key of the request, see TrackingSupplier._parse_cached
+    key: str
+    digest: str
+    ids: Tuple['TrackingIdentifier', ...]
+    # whether the response was text, rather than bytes
+    text: bool
+    first_seen: float
+
+
+class ResponseArchive:
+    """
+    Keeps every distinct carrier response on disk, so they can be parsed again later,
+    e.g. after fixing a parser for a page the carrier changed.
+
+    Responses are stored zlib compressed under their digest in objects/, so a response
+    that is seen over and over is stored once. An SQLite index records which carrier
+    request (and which packages) each of them was the answer to.
+    """
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.join(path, 'objects'), exist_ok=True)
+        self._lock = threading.Lock()
+        # shard workers write to the same index from other processes
+        self._conn = sqlite3.connect(os.path.join(path, 'index.sqlite3'), timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                '  carrier TEXT NOT NULL,'
+                '  key TEXT NOT NULL,'
+                '  digest TEXT NOT NULL,'
+                '  ids TEXT NOT NULL,'
+                '  text INTEGER NOT NULL,'
+                '  first_seen REAL NOT NULL,'
+                '  PRIMARY KEY (carrier, key, digest)'
+                ')'
+            )
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.path, 'objects', digest[:2], digest[2:])
+
+    def store(self, carrier: str, key: str, ids: Iterable['TrackingIdentifier'], raw: Union[str, bytes],
+              fetched_at: float, digest: Optional[bytes] = None):
+        """
+        Archive a response, unless the very same one was already archived for this request.
+
+        :param digest: content_digest(raw), if it is already known
+        """
+        digest = (digest or content_digest(raw)).hex()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # written next to the target and renamed, so readers never see half an object
+            tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+            with open(tmp, 'wb') as f:
+                f.write(zlib.compress(raw.encode() if isinstance(raw, str) else raw))
+            os.replace(tmp, path)
+
+        row = (carrier, key, digest, json.dumps([id.to_dict() for id in ids]), isinstance(raw, str), fetched_at)
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR IGNORE INTO responses VALUES (?, ?, ?, ?, ?, ?)', row)
+
+    def entries(self, carriers: Optional[Iterable[str]] = None) -> List[ArchiveEntry]:
+        """
+        the archived responses, oldest first, optionally only those of some carriers
+        """
+        from .models import TrackingIdentifier
+        query = 'SELECT carrier, key, digest, ids, text, first_seen FROM responses'
+        params: List[str] = []
+        if carriers:
+            params = list(carriers)
+            query += ' WHERE carrier IN ({})'.format(', '.join('?' * len(params)))
+        with self._lock:
+            rows = self._conn.execute(query + ' ORDER BY first_seen', params).fetchall()
+        return [
+            ArchiveEntry(carrier, key, digest, tuple(TrackingIdentifier.from_dict(id) for id in json.loads(ids)),
+                         bool(text), first_seen)
+            for carrier, key, digest, ids, text, first_seen in rows
+        ]
+
+    def load(self, entry: ArchiveEntry) -> Union[str, bytes]:
+        """
+        the response of an entry, exactly as it was handed to the parser
+        """
+        with open(self._object_path(entry.digest), 'rb') as f:
+            raw = zlib.decompress(f.read())
+        return raw.decode() if entry.text else raw
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_archive: Optional[ResponseArchive] = None
+_archive_lock = threading.Lock()
+
+
+def configure_archive(path: Optional[str]) -> Optional[ResponseArchive]:
+    """
+    Start archiving all responses the suppliers parse to path, or stop if it is None.
+    """
+    global _archive
+    with _archive_lock:
+        if _archive is not None:
+            _archive.close()
+        _archive = ResponseArchive(path) if path is not None else None
+        return _archive
+
+
+def active_archive() -> Optional[ResponseArchive]:
+    """
+    the archive responses go to, None unless configure_archive was called
+    """
+    return _archive
+
+
+def archive_response(carrier: str, key: str, ids: Iterable['TrackingIdentifier'], raw: Union[str, bytes],
+                     fetched_at: float, digest: Optional[bytes] = None):
+    """
+    store a response in the active archive, if there is one. Failing to do so is logged, not raised.
+    """
+    archive = _archive
+    if archive is None:
+        return
+    try:
+        archive.store(carrier, key, ids, raw, fetched_at, digest)
+    except (OSError, sqlite3.Error) as e:
+        logger.error("Could not archive the response for {} from {}: {}".format(key, carrier, e))
@@ -1,10 +1,10 @@
-import datetime
+import json
 from dataclasses import dataclass
-from typing import Optional
-
-import requests
+from typing import Dict, List, Optional
 
+from .detect import NumberFormat, s10_valid
 from .models import TrackingIdentifier, PackageState, TrackingUpdateItem, TrackingState, TrackingSupplier
+from .normalize import EPOCH, location, parse_datetime
 
 
 @dataclass
@@ -20,8 +20,11 @@ class AsendiaTracking(TrackingSupplier):
     name = 'asendia'
     config: AsendiaConfig
 
+    # Asendia hands parcels over to the national posts, with their S10 numbers
+    number_formats = (NumberFormat(r'[A-Z]{2}\d{9}[A-Z]{2}', s10_valid),)
+
     def get_details_for(self, details: TrackingIdentifier) -> Optional[TrackingState]:
-        resp = requests.get(
+        resp = self.http.get(
             "https://a1reportapi.asendiaprod.com/api/A1/TrackingBranded/Tracking",
             params={
                 'trackingKey': self.config.tracking_key,
@@ -29,7 +32,8 @@ class AsendiaTracking(TrackingSupplier):
             },
             headers={
                 'Authorization': self.config.auth_header,
-                'X-AsendiaOne-ApiKey': self.config.api_key
+                'X-AsendiaOne-ApiKey': self.config.api_key,
+                **self.response_cache.validators(details.number)
             }
         )
 
@@ -40,8 +44,12 @@ class AsendiaTracking(TrackingSupplier):
             ))
             return None
 
-        json = resp.json()
-        return self._create_tracking_result_from_json(json, details)
+        return self._parse_cached(details.number, resp.content, [details], lambda: self.parse_raw(resp.content, [details]),
+                                  resp)[details]
+
+    def parse_raw(self, raw: bytes, ids: List[TrackingIdentifier]) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        data = json.loads(raw)
+        return {id: self._create_tracking_result_from_json(data, id) for id in ids}
 
     def _create_tracking_result_from_json(self, json: dict, id: TrackingIdentifier):
         progress = (
@@ -90,15 +98,15 @@ def _description(json: dict):
 def _last_update(json: dict):
     tracking = json['trackingBrandedDetail']
     if len(tracking) == 0:
-        return datetime.datetime(1970, 1, 1)
-    return datetime.datetime.fromisoformat(tracking[0]['eventOn'])
+        return EPOCH
+    return parse_datetime(tracking[0]['eventOn'])
 
 
 def _process_updates(json: dict):
     return sorted(
         [TrackingUpdateItem(
             item['eventDescription'],
-            datetime.datetime.fromisoformat(item['eventOn']),
+            parse_datetime(item['eventOn']),
             _process_location(item['eventLocationDetails'])
         ) for item in json['trackingBrandedDetail']],
         key=lambda item: item.when,
@@ -108,10 +116,7 @@ def _process_updates(json: dict):
 
 def _process_location(item: dict):
     if item['city'] is not None:
-        if item['province'] is not None:
-            if item['countryIso2'] is not None:
-                return "{city}, {province}, {countryIso2}".format(**item)
-        if item['countryIso2'] is not None:
-            return "{city}, {countryIso2}".format(**item)
-        return item['city']
-    return item['countryName']
+        if item['province'] is not None and item['countryIso2'] is not None:
+            return location(item['city'], item['province'], item['countryIso2'])
+        return location(item['city'], item['countryIso2'])
+    return location(item['countryName'])
@@ -0,0 +1,84 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .models import TrackingState
+
+
+def content_digest(raw: Union[str, bytes]) -> bytes:
+    if isinstance(raw, str):
+        raw = raw.encode()
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+
+@dataclass
+class _CacheEntry:
+    digest: Optional[bytes]
+    # parsed states by tracking number
+    states: Dict[str, Optional['TrackingState']]
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+class ResponseCache:
+    """
+    Remembers the digest of the last response per request, together with what it was
+    parsed into, so an unchanged response doesn't have to be parsed again.
+
+    Requests are identified by a key chosen by the supplier, usually the tracking
+    number(s) it asked for. Only the maxsize most recently used keys are kept.
+    """
+    maxsize: int
+
+    _entries: 'OrderedDict[str, _CacheEntry]'
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, digest: Optional[bytes]) -> Optional[Dict[str, Optional['TrackingState']]]:
+        """
+        The states parsed from the last response for key, if its digest matches.
+
+        A digest of None matches any entry, for when the carrier told us the response didn't change.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (digest is not None and entry.digest != digest):
+                return None
+            self._entries.move_to_end(key)
+            return entry.states
+
+    def put(self, key: str, digest: bytes, states: Dict[str, Optional['TrackingState']],
+            etag: Optional[str] = None, last_modified: Optional[str] = None):
+        with self._lock:
+            self._entries[key] = _CacheEntry(digest, states, etag, last_modified)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def update(self, key: str, states: Dict[str, Optional['TrackingState']]):
+        """
+        Replace some of the states parsed for key, keeping its digest and validators.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.states = {**entry.states, **states}
+
+    def validators(self, key: str) -> Dict[str, str]:
+        """
+        Headers for a conditional request, if the last response for key came with an ETag or Last-Modified.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        headers = dict()
+        if entry is not None and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
@@ -0,0 +1,142 @@
+"""
+Telling the carrier of a tracking number from the number alone.
+
+Suppliers declare the formats of their numbers as TrackingSupplier.number_formats,
+CarrierDetector compiles the formats of all carriers into a single regex.
+"""
+import re
+import threading
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Callable, Dict, List, Mapping, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .registry import CarrierRegistry
+
+logger = getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class NumberFormat:
+    # a regex the whole (upper case, whitespace free) number has to match
+    pattern: str
+    # validates the check digit of numbers matching pattern, if the format has one
+    check: Optional[Callable[[str], bool]] = None
+
+
+def _digit_sum(digits: str, weights) -> int:
+    return sum(int(digit) * weight for digit, weight in zip(digits, weights))
+
+
+def s10_valid(number: str) -> bool:
+    """
+    UPU S10, e.g. RR123456785DE: two letters, eight digits, a check digit and the country
+    """
+    remainder = 11 - _digit_sum(number[2:10], (8, 6, 4, 2, 3, 5, 9, 7)) % 11
+    check = {10: 0, 11: 5}.get(remainder, remainder)
+    return int(number[10]) == check
+
+
+def gs1_valid(number: str) -> bool:
+    """
+    GS1 mod 10, as used by SSCCs and EANs: weights 3 and 1, starting at the right
+    """
+    body, check = number[:-1], int(number[-1])
+    return (10 - _digit_sum(reversed(body), (3, 1) * len(body)) % 10) % 10 == check
+
+
+def identcode_valid(number: str) -> bool:
+    """
+    the 12 digit DHL Identcode: weights 4 and 9, starting at the left
+    """
+    body, check = number[:-1], int(number[-1])
+    return (10 - _digit_sum(body, (4, 9) * len(body)) % 10) % 10 == check
+
+
+def gls_valid(number: str) -> bool:
+    """
+    the 12 digit GLS parcel number: GS1 mod 10 plus one
+    """
+    body, check = number[:-1], int(number[-1])
+    return (10 - (_digit_sum(reversed(body), (3, 1) * len(body)) + 1) % 10) % 10 == check
+
+
+def normalize_number(number: str) -> str:
+    return ''.join(number.split()).upper()
+
+
+class CarrierDetector:
+    """
+    Finds the carriers a tracking number could belong to, without asking any of them.
+
+    All formats are combined into one regex of lookaheads, so a number is matched
+    against all of them in a single call. Carriers are tried in the order formats were
+    given in, and carriers whose check digit doesn't match are only returned if
+    no carrier fits better, e.g. for a rule that turned out to be incomplete.
+    """
+    formats: Dict[str, Tuple[NumberFormat, ...]]
+
+    _regex: Optional['re.Pattern']
+    # the carrier and format behind every group of _regex
+    _groups: List[Tuple[str, NumberFormat]]
+
+    def __init__(self, formats: Mapping[str, Tuple[NumberFormat, ...]]):
+        self.formats = dict(formats)
+        self._groups = [(carrier, format) for carrier, carrier_formats in self.formats.items()
+                        for format in carrier_formats]
+        self._regex = re.compile(''.join(
+            '(?=(?P<f{}>{})\\Z)?'.format(i, format.pattern) for i, (_, format) in enumerate(self._groups)
+        )) if self._groups else None
+
+    @classmethod
+    def from_registry(cls, registry: 'CarrierRegistry') -> 'CarrierDetector':
+        """
+        a detector for all carriers of registry, this imports all of them
+        """
+        formats = dict()
+        for name in registry:
+            try:
+                supplier_cls, _ = registry[name]
+            except Exception:
+                logger.exception("Could not load carrier {} to detect its numbers:".format(name))
+                continue
+            formats[name] = tuple(supplier_cls.number_formats)
+        return cls(formats)
+
+    def candidates(self, number: str) -> List[str]:
+        """
+        the carriers number could belong to, the most likely first
+        """
+        if self._regex is None:
+            return []
+        number = normalize_number(number)
+        match = self._regex.match(number)
+        valid, unchecked, invalid = [], [], []
+        for i, group in enumerate(match.groups()):
+            if group is None:
+                continue
+            carrier, format = self._groups[i]
+            if format.check is None:
+                unchecked.append(carrier)
+            elif format.check(number):
+                valid.append(carrier)
+            else:
+                invalid.append(carrier)
+        found = list(dict.fromkeys(valid + unchecked))
+        return found or list(dict.fromkeys(invalid))
+
+
+_detector: Optional[CarrierDetector] = None
+_detector_lock = threading.Lock()
+
+
+def shared_detector() -> CarrierDetector:
+    """
+    a detector for all carriers in ALL_MODULES, built the first time it is needed
+    """
+    global _detector
+    with _detector_lock:
+        if _detector is None:
+            from .registry import ALL_MODULES
+            _detector = CarrierDetector.from_registry(ALL_MODULES)
+        return _detector
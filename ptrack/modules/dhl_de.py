@@ -1,40 +1,50 @@
 import json
 import re
-import subprocess
 from dataclasses import dataclass
-from datetime import datetime
-from typing import Optional
+from typing import Optional, List, Dict
+from .detect import NumberFormat, gs1_valid, identcode_valid, s10_valid
+from .helpers import extract_js_string_literal, iter_response_text
 from .models import TrackingState, TrackingIdentifier, TrackingSupplier, TrackingUpdateItem, PackageState
+from .normalize import EPOCH, location, parse_datetime
 
 
 @dataclass()
 class DHL_DE_Config:
     user_agent: str = "Mozilla/5.0 (X11; Linux x86_64; rv:102.0) Gecko/20100101 Firefox/102.0"
     timeout: int = 10
+    # read the search page incrementally and hang up once the embedded state is complete
+    streaming: bool = True
 
 
-def _cut_json_string_from_response(resp: str):
-    start_identifier = 'initialState: JSON.parse("'
-    end_identifier = '"),'
-    json_start = resp.index(start_identifier) + len(start_identifier)
-    return resp[
-           json_start:resp.index(end_identifier, json_start)
-       ].replace('\\"', '"')
+_JSON_START_MARKER = 'initialState: JSON.parse("'
 
 
-def _info_from_json_obj(data: dict, id: TrackingIdentifier) -> TrackingState:
-    obj = data['sendungen'][0]
+def _cut_json_string_from_response(resp: str) -> Optional[str]:
+    return extract_js_string_literal([resp], _JSON_START_MARKER)
+
+
+def _match_sendungen(data: dict, ids: List[TrackingIdentifier]) -> Dict[TrackingIdentifier, Optional[dict]]:
+    """
+    Assign the shipments of a (possibly batched) search result to the ids they were requested for.
+    """
+    sendungen = data.get('sendungen', [])
+    if len(ids) == 1 and len(sendungen) == 1:
+        return {ids[0]: sendungen[0]}
+    by_number = {obj.get('id'): obj for obj in sendungen}
+    return {id: by_number.get(id.number) for id in ids}
+
+
+def _info_from_json_obj(obj: dict, id: TrackingIdentifier) -> TrackingState:
     details = obj['sendungsdetails']
     verlauf = details['sendungsverlauf']
 
     items = []
     for item in verlauf.get('events', []):
-        ort = item.get('ort', None)
         items.append(
             TrackingUpdateItem(
                 text=item.get('status', ""),
-                when=datetime.fromisoformat(item['datum']),
-                where=ort if ort else None
+                when=parse_datetime(item['datum']),
+                where=location(item.get('ort', None))
             )
         )
     return TrackingState(
@@ -42,7 +52,7 @@ def _info_from_json_obj(data: dict, id: TrackingIdentifier) -> TrackingState:
         state=_get_package_state(details),
         short_description=verlauf.get('kurzStatus', "Status offen"),
         additional_info=verlauf.get('aktuellerStatus', "Wir erwarten Ihre Sendungsdaten in Kürze."),
-        last_update=datetime.fromisoformat(verlauf['datumAktuellerStatus']) if 'datumAktuellerStatus' in verlauf else datetime(1970, 1, 1, 0, 0, 0),
+        last_update=parse_datetime(verlauf['datumAktuellerStatus']) if 'datumAktuellerStatus' in verlauf else EPOCH,
         progress=(int(verlauf['fortschritt']), int(verlauf['maximalFortschritt'])),
         is_delivered=details['istZugestellt'],
         is_retoure=details['retoure'],
@@ -79,34 +89,99 @@ class DHL_DE(TrackingSupplier):
     name = "dhl"
     config: DHL_DE_Config
 
+    # the search accepts a comma separated list of piece codes
+    batch_size = 20
+
+    number_formats = (
+        # parcels, the Identcode
+        NumberFormat(r'\d{12}', identcode_valid),
+        # parcels, an SSCC behind its application identifier 00
+        NumberFormat(r'00\d{18}', lambda number: gs1_valid(number[2:])),
+        NumberFormat(r'JJD\d{16,21}'),
+        # letters and parcels sent abroad by Deutsche Post
+        NumberFormat(r'[A-Z]{2}\d{9}DE', s10_valid),
+    )
+
     def get_details_for(self, details: TrackingIdentifier) -> Optional[TrackingState]:
+        return self.get_details_for_many([details])[details]
+
+    def get_details_for_many(self, ids: List[TrackingIdentifier]) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        numbers = ",".join(id.number for id in ids)
+        json_string = self._fetch_json_string(numbers)
+        if json_string is None:
+            return {id: None for id in ids}
         try:
-            result = subprocess.check_output([
-                'curl', '-s',
-                f'https://www.dhl.de/int-verfolgen/search?language=de&lang=de&domain=de&piececode={details.number}',
-                '-H', f'User-Agent: {self.config.user_agent}'
-            ], timeout=self.config.timeout, stderr=subprocess.DEVNULL).decode()
-        except subprocess.TimeoutExpired:
-            self.logger.error("Timeout during request for {}".format(details.number))
-            return None
-        except subprocess.SubprocessError as err:
-            self.logger.exception("Error during HTTP request for {}:".format(
-                details.number,
-            ))
+            data = json.loads(json_string)
+        except:
+            self.logger.exception('Error processing json:')
+            return {id: None for id in ids}
+
+        # which packages are due together changes from poll to poll, so every shipment
+        # is cached under its own number rather than the whole batch
+        results = dict()
+        for id, obj in _match_sendungen(data, ids).items():
+            if obj is None:
+                self.logger.error("No shipment for {} in response".format(id.number))
+                results[id] = None
+                continue
+            raw = json.dumps({'sendungen': [obj]}, ensure_ascii=False)
+            results.update(self._parse_cached(id.number, raw, [id],
+                                              lambda id=id, obj=obj: {id: self._state_from_obj(obj, id)}))
+        return results
+
+    def parse_raw(self, raw: str, ids: List[TrackingIdentifier]) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        return self._parse_json_string(raw, ids)
+
+    def _parse_json_string(self, json_string: str, ids: List[TrackingIdentifier]) \
+            -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        try:
+            data = json.loads(json_string)
+        except:
+            self.logger.exception('Error processing json:')
+            return {id: None for id in ids}
+
+        results = dict()
+        for id, obj in _match_sendungen(data, ids).items():
+            if obj is None:
+                self.logger.error("No shipment for {} in response".format(id.number))
+                results[id] = None
+                continue
+            results[id] = self._state_from_obj(obj, id)
+        return results
+
+    def _state_from_obj(self, obj: dict, id: TrackingIdentifier) -> Optional[TrackingState]:
+        try:
+            return _info_from_json_obj(obj, id)
+        except:
+            self.logger.exception('Error processing json:')
             return None
 
-        if 'window.__INITIAL_APP_STATE__' not in result:
+    def _fetch_json_string(self, numbers: str) -> Optional[str]:
+        """
+        fetch the search page and cut the JSON encoded app state out of it
+        """
+        url = f'https://www.dhl.de/int-verfolgen/search?language=de&lang=de&domain=de&piececode={numbers}'
+        headers = {'User-Agent': self.config.user_agent}
+
+        if self.config.streaming:
+            # leaving the with block closes the connection, even if the page isn't fully read
+            with self.http.get(url, headers=headers, timeout=self.config.timeout, stream=True) as resp:
+                json_string = extract_js_string_literal(iter_response_text(resp), _JSON_START_MARKER) if resp.ok else None
+                if json_string is None:
+                    self.logger.error("Could not fetch info for {}: Response status {}".format(
+                        numbers,
+                        resp.status_code
+                    ))
+                return json_string
+
+        resp = self.http.get(url, headers=headers, timeout=self.config.timeout)
+        result = resp.text
+
+        if not resp.ok or 'window.__INITIAL_APP_STATE__' not in result:
             self.logger.error("Could not fetch info for {}: Response of {}".format(
-                details.number,
+                numbers,
                 result[:50]
             ))
             return None
 
-        json_string = _cut_json_string_from_response(result)
-
-        try:
-            data = json.loads(json_string)
-            return _info_from_json_obj(data, details)
-        except:
-            self.logger.exception('Error processing json:')
-            return None
+        return _cut_json_string_from_response(result)
@@ -1,54 +1,58 @@
 import datetime
 import json
 from dataclasses import dataclass
-from typing import Optional
+from typing import Dict, Optional, List
 
-import requests
-
-from .helpers import find_substring
+from .detect import NumberFormat
+from .helpers import find_substring, find_substrings_in_stream, iter_response_text
 from .models import TrackingState, TrackingIdentifier, TrackingSupplier, TrackingUpdateItem, PackageState
+from .normalize import location, parse_datetime
 
 
 @dataclass
 class GlobalPostSettings:
     user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.0.0 Safari/537.36'
+    # read the page incrementally and hang up once everything we need was found
+    streaming = True
+
+
+# (start, end) markers of the embedded tracking JSON and the long status text
+_MARKERS = [
+    ('var trackingData = ', ';\n'),
+    ('<span class="sidebar-right-ele text-normal">', '</span>'),
+]
 
 
 def _parse_event_position(info: dict, prefix: str):
-    return ", ".join(filter(lambda x: x, [
-        info[prefix + 'EventCity'],
-        info[prefix + 'EventState'],
-        info[prefix + 'EventCountry']
-    ])) or None
+    return location(info[prefix + 'EventCity'], info[prefix + 'EventState'], info[prefix + 'EventCountry'])
 
 
 class GlobalPostTracking(TrackingSupplier):
     name = 'globalpost'
     config: GlobalPostSettings
 
-    def get_details_for(self, details: TrackingIdentifier) -> Optional[TrackingState]:
-        resp = requests.get(
-            'https://www.goglobalpost.com/track-detail/',
-            params={
-                't': details.number
-            },
-            headers={
-                'User-Agent': self.config.user_agent
-            }
-        )
+    number_formats = (NumberFormat(r'GP\d{8,16}'),)
 
-        if not resp.ok:
-            self.logger.error("Could not fetch GlobalPost info for {}: {}\n{}".format(
-                details.number,
-                resp.status_code,
-                resp.text[:200]
-            ))
+    def get_details_for(self, details: TrackingIdentifier) -> Optional[TrackingState]:
+        parts = self._fetch_parts(details.number)
+        if parts is None:
             return None
-
-        raw_json = find_substring(resp.text, 'var trackingData = ', ';\n')
+        raw = "\0".join(parts)
+        key = details.number
+        if 'today' in parts[0].lower():
+            # the same page means another date tomorrow, so what it was parsed into today
+            # must not be taken from the cache then
+            key = '{}@{:%Y-%m-%d}'.format(details.number, datetime.date.today())
+        return self._parse_cached(key, raw, [details], lambda: self.parse_raw(raw, [details]))[details]
+
+    def parse_raw(self, raw: str, ids: List[TrackingIdentifier]) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        parts = raw.split("\0")
+        return {id: self._state_from_parts(parts, id) for id in ids}
+
+    def _state_from_parts(self, parts: List[str], details: TrackingIdentifier) -> TrackingState:
+        raw_json, long_status = parts
         info = json.loads(raw_json)
-
-        long_status = find_substring(resp.text, '<span class="sidebar-right-ele text-normal">', '</span>').strip()
+        long_status = long_status.strip()
 
         #TODO: the extracted JSON only contains information on the first update and the last update as far as I can tell. TO get all stops we have to parse HTML unfortunately.
         #TODO: The is_delivered and progress values are just hardcoded at the moment, we need to get them from the page somehow. Maybe we can use the large progess par up top?
@@ -77,15 +81,48 @@ class GlobalPostTracking(TrackingSupplier):
             ]
         )
 
+    def _fetch_parts(self, number: str) -> Optional[List[str]]:
+        """
+        fetch the tracking page and cut the parts described by _MARKERS out of it
+        """
+        request = dict(
+            url='https://www.goglobalpost.com/track-detail/',
+            params={
+                't': number
+            },
+            headers={
+                'User-Agent': self.config.user_agent
+            }
+        )
+
+        if not self.config.streaming:
+            resp = self.http.get(**request)
+            if not resp.ok:
+                self._log_error_response(number, resp)
+                return None
+            return [find_substring(resp.text, start, end) for start, end in _MARKERS]
+
+        # leaving the with block closes the connection, even if the page isn't fully read
+        with self.http.get(**request, stream=True) as resp:
+            if not resp.ok:
+                self._log_error_response(number, resp)
+                return None
+            parts = find_substrings_in_stream(iter_response_text(resp), _MARKERS)
+            if parts is None:
+                self.logger.error("Could not find tracking data for {} in response".format(number))
+            return parts
+
+    def _log_error_response(self, number: str, resp):
+        self.logger.error("Could not fetch GlobalPost info for {}: {}\n{}".format(
+            number,
+            resp.status_code,
+            resp.text[:200]
+        ))
+
 
 def _parse_global_post_date_time_string(dtstring: str) -> datetime.datetime:
     date, time = dtstring.split(' - ', 1)
     if date.strip().lower() == 'today':
-        date = datetime.date.today()
-    else:
-        date = datetime.datetime.strptime(date.strip().lower(), '%b %d, %Y').date()
-
-    return datetime.datetime.combine(
-        date,
-        datetime.datetime.strptime(time.strip().upper(), '%I:%M %p').time()
-    )
+        # resolved before parsing, so the cached result of yesterdays "today" isn't reused
+        date = '{:%b %d, %Y}'.format(datetime.date.today())
+    return parse_datetime('{} - {}'.format(date.strip(), time.strip()))
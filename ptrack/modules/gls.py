@@ -1,12 +1,12 @@
 import dataclasses
-from datetime import datetime
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Dict
 from bs4 import BeautifulSoup, ResultSet, Tag
-from dateutil.parser import parse
+import lxml.etree
+import lxml.html
 
-import requests
-
-from ptrack.modules import TrackingSupplier, TrackingIdentifier, TrackingState, TrackingUpdateItem, PackageState
+from .detect import NumberFormat, gls_valid
+from .models import TrackingSupplier, TrackingIdentifier, TrackingState, TrackingUpdateItem, PackageState
+from .normalize import EPOCH, location, parse_datetime
 
 PROGRESS_TO_STATE = {
     0: PackageState.ANNOUNCED,
@@ -18,43 +18,94 @@ PROGRESS_TO_STATE = {
 }
 
 
+def _xpath_class(name: str) -> str:
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(name)
+
+
+_XPATH_TABLE = lxml.etree.XPath("//table[{}]".format(_xpath_class('data_table')))
+_XPATH_ROWS = lxml.etree.XPath(".//tbody/tr")
+_XPATH_CELLS = lxml.etree.XPath(".//td")
+_XPATH_ICON_BOXES = lxml.etree.XPath("(//*[{}])[1]".format(_xpath_class('ce_icon_box_container')))
+_XPATH_COMPLETED = lxml.etree.XPath("count(.//*[{}]) + count(.//*[{}])".format(
+    _xpath_class('status--complete'), _xpath_class('status--current')
+))
+_XPATH_STEPS = lxml.etree.XPath("count(.//*[{}])".format(_xpath_class('ce_icon_box')))
+_XPATH_STATE_TEXT = lxml.etree.XPath("//*[{} and {}]//*[{}]//p[{}]//strong".format(
+    _xpath_class('container'), _xpath_class('pt-20px'), _xpath_class('col-12'), _xpath_class('lead')
+))
+
+
 @dataclasses.dataclass
 class GLS_Config:
     base_url = "https://api.gls-pakete.de/trackandtrace?lang={lang}&match={id}"
     lang = "de"
+    # "lxml" parses the tracking page with precompiled XPath expressions, "bs4" with
+    # BeautifulSoup. Both produce the same result, bs4 is kept as the reference.
+    parser = "lxml"
 
 
 class GLS(TrackingSupplier):
+    name = 'gls'
     config: GLS_Config
 
+    # match= takes a comma separated list, the response is keyed by tracking number
+    batch_size = 10
+
+    number_formats = (
+        # the parcel number, with and without its check digit
+        NumberFormat(r'\d{11}'),
+        NumberFormat(r'\d{12}', gls_valid),
+    )
+
     def __init__(self, config: GLS_Config):
         super().__init__(config)
 
     def get_details_for(self, details: TrackingIdentifier) -> Optional[TrackingState]:
-        resp = requests.get(self.config.base_url.format(lang=self.config.lang, id=details.number))
+        return self.get_details_for_many([details])[details]
+
+    def get_details_for_many(self, ids: List[TrackingIdentifier]) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        resp = self.http.get(self.config.base_url.format(lang=self.config.lang, id=",".join(id.number for id in ids)))
 
         if not resp.ok:
-            return None
+            return {id: None for id in ids}
 
         data = resp.json().get("content", None)
-        if not data or not details.number in data:
+        if not data:
             self.logger.error("malformed JSON response")
-            return None
-        data = data[details.number]
-
-        return self._parse_gls_response_html(data['html'], details)
+            return {id: None for id in ids}
+
+        results = dict()
+        for id in ids:
+            if id.number not in data:
+                self.logger.error("malformed JSON response, missing {}".format(id.number))
+                results[id] = None
+                continue
+            html = data[id.number]['html']
+            results[id] = self._parse_cached(id.number, html, [id], lambda: self.parse_raw(html, [id]))[id]
+        return results
+
+    def parse_raw(self, raw: str, ids: List[TrackingIdentifier]) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        # the response has a separate page for every tracking number
+        return {id: self._parse_html(raw, id) for id in ids}
+
+    def _parse_html(self, html: str, details: TrackingIdentifier) -> Optional[TrackingState]:
+        if self.config.parser == "bs4":
+            return self._parse_gls_response_html(html, details)
+        return self._parse_gls_response_html_fast(html, details)
 
     def _parse_gls_response_html(self, html: str, details: TrackingIdentifier) -> Optional[TrackingState]:
         soup = BeautifulSoup(html, "lxml")
-        table = soup.select_one("table.data_table")
-        if table is None:
-            self.logger.error("more than one data_table?!")
+        tables = soup.select("table.data_table")
+        if not tables:
+            self.logger.error("no data_table found for {}".format(details.number))
             return None
+        if len(tables) > 1:
+            self.logger.warning("more than one data_table?! using the first")
 
         tracking_data: List[TrackingUpdateItem] = []
-        for line in table.select("tbody > tr"):
+        for line in tables[0].select("tbody > tr"):
             tds = line.select("td")
-            tracking_data.append(TrackingUpdateItem(tds[2].text.strip(), self._get_datetime_from_tds(tds), tds[3].text.strip()))
+            tracking_data.append(TrackingUpdateItem(tds[2].text.strip(), self._get_datetime_from_tds(tds), location(tds[3].text)))
 
         tracking_data = sorted(tracking_data, key=lambda x: x.when, reverse=True)
 
@@ -66,7 +117,56 @@ class GLS(TrackingSupplier):
             PROGRESS_TO_STATE[progress[0]],
             description,
             additional_info,
-            tracking_data[0].when if tracking_data else datetime(1970, 1, 1, 0, 0, 0),
+            tracking_data[0].when if tracking_data else EPOCH,
+            progress,
+            progress[0] == progress[1],
+            None,
+            None,
+            tracking_data
+        )
+
+    def _parse_gls_response_html_fast(self, html: str, details: TrackingIdentifier) -> Optional[TrackingState]:
+        """
+        Same as _parse_gls_response_html, but walks the lxml tree directly instead of
+        building a BeautifulSoup tree and running CSS selectors over it.
+        """
+        root = lxml.html.fromstring(html)
+        tables = _XPATH_TABLE(root)
+        if not tables:
+            self.logger.error("no data_table found for {}".format(details.number))
+            return None
+        if len(tables) > 1:
+            self.logger.warning("more than one data_table?! using the first")
+
+        tracking_data: List[TrackingUpdateItem] = []
+        for line in _XPATH_ROWS(tables[0]):
+            tds = _XPATH_CELLS(line)
+            tracking_data.append(TrackingUpdateItem(
+                tds[2].text_content().strip(),
+                # the page is german, so dates are day first
+                parse_datetime(tds[0].text_content().strip() + ' ' + tds[1].text_content().strip(), dayfirst=True),
+                location(tds[3].text_content())
+            ))
+
+        tracking_data = sorted(tracking_data, key=lambda x: x.when, reverse=True)
+
+        base = _XPATH_ICON_BOXES(root)[0]
+        progress = int(_XPATH_COMPLETED(base)), int(_XPATH_STEPS(base))
+
+        candidates = [strong.text_content().strip() for strong in _XPATH_STATE_TEXT(root)]
+        if len(candidates) == 2:
+            description, additional_info = candidates[0], "Arriving at " + candidates[1]
+        elif len(candidates) == 1:
+            description, additional_info = candidates[0], ""
+        else:
+            description, additional_info = "Announced", ""
+
+        return TrackingState(
+            details,
+            PROGRESS_TO_STATE[progress[0]],
+            description,
+            additional_info,
+            tracking_data[0].when if tracking_data else EPOCH,
             progress,
             progress[0] == progress[1],
             None,
@@ -79,7 +179,8 @@ class GLS(TrackingSupplier):
         return len(base.select('.status--complete')) + len(base.select('.status--current')), len(base.select('.ce_icon_box'))
 
     def _get_datetime_from_tds(self, tds: ResultSet[Tag]):
-        return parse(tds[0].text.strip() + ' ' + tds[1].text.strip())
+        # the page is german, so dates are day first
+        return parse_datetime(tds[0].text.strip() + ' ' + tds[1].text.strip(), dayfirst=True)
 
     def _get_state_text(self, soup: BeautifulSoup):
         candidates = soup.select(".container.pt-20px .col-12 p.lead strong")
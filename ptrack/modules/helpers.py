@@ -1,6 +1,102 @@
+import json
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import requests
+
+
 def find_substring(text: str, start_marker: str, end_marker: str) -> str:
     start = text.index(start_marker) + len(start_marker)
     return text[start:text.index(end_marker, start)]
 
 
+def iter_response_text(resp: 'requests.Response', chunk_size: int = 16 * 1024) -> Iterator[str]:
+    """
+    Decoded text of a streamed response, chunk by chunk.
+    """
+    if resp.encoding is None:
+        resp.encoding = 'utf-8'
+    return resp.iter_content(chunk_size=chunk_size, decode_unicode=True)
+
+
+def find_substrings_in_stream(chunks: Iterable[str], markers: List[Tuple[str, str]]) -> Optional[List[str]]:
+    """
+    Same as find_substring for several (start_marker, end_marker) pairs, but on a stream of text.
+
+    Only the part of the stream that could still contain a pending match is kept in memory,
+    and no more chunks are consumed once all substrings were found.
+
+    :return: the substrings in the order of markers, or None if the stream ended before all were found
+    """
+    results: List[Optional[str]] = [None] * len(markers)
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        keep = len(buffer)
+        for i, (start_marker, end_marker) in enumerate(markers):
+            if results[i] is not None:
+                continue
+            start = buffer.find(start_marker)
+            if start < 0:
+                # the marker might be split across chunks
+                keep = min(keep, max(len(buffer) - len(start_marker) + 1, 0))
+                continue
+            end = buffer.find(end_marker, start + len(start_marker))
+            if end < 0:
+                keep = min(keep, start)
+                continue
+            results[i] = buffer[start + len(start_marker):end]
+        if all(result is not None for result in results):
+            return results
+        buffer = buffer[keep:]
+    return None
+
+
+# the body of a double quoted JS string literal, up to (excluding) its closing quote
+_JS_STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+
+
+def extract_js_string_literal(chunks: Iterable[str], start_marker: str) -> Optional[str]:
+    """
+    Find start_marker in a stream of text and decode the double quoted JS string literal
+    that follows it (start_marker has to include the opening quote).
+
+    Escaped quotes inside the literal are handled, and no more chunks are consumed once
+    the closing quote was found.
+
+    :return: the decoded string, or None if the stream ended before the literal was complete
+    """
+    buffer = ''
+    chunks = iter(chunks)
+    for chunk in chunks:
+        buffer += chunk
+        start = buffer.find(start_marker)
+        if start >= 0:
+            buffer = buffer[start + len(start_marker):]
+            break
+        buffer = buffer[max(len(buffer) - len(start_marker) + 1, 0):]
+    else:
+        return None
+
+    parts = []
+    while True:
+        end = _JS_STRING_BODY.match(buffer).end()
+        if end < len(buffer) and buffer[end] == '"':
+            parts.append(buffer[:end])
+            return _decode_js_string_body(''.join(parts))
+        # keep a trailing backslash around, its escaped character is still to come
+        parts.append(buffer[:end])
+        buffer = buffer[end:]
+        chunk = next(chunks, None)
+        if chunk is None:
+            return None
+        buffer += chunk
+
 
+def _decode_js_string_body(body: str) -> str:
+    try:
+        return json.loads('"' + body + '"')
+    except json.JSONDecodeError:
+        # escapes that JSON doesn't know, like \' or \x41
+        return body.encode('latin-1', 'backslashreplace').decode('unicode_escape')
@@ -0,0 +1,223 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# upper bounds in seconds, from a cached parse to a carrier that is about to time out
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Histogram:
+    """
+    Counts observations into fixed buckets, like a Prometheus histogram.
+    """
+    buckets: Tuple[float, ...]
+    counts: List[int]
+    sum: float
+    count: int
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        estimate the q-quantile, interpolating linearly within its bucket
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0
+                if i == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def to_dict(self) -> dict:
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Histogram':
+        histogram = cls(tuple(data['buckets']))
+        histogram.counts = list(data['counts'])
+        histogram.sum = data['sum']
+        histogram.count = data['count']
+        return histogram
+
+
+class Metrics:
+    """
+    Counters and latency histograms of this process, keyed by name and labels.
+
+    Recording is cheap enough for the hot paths: a lock and a dict lookup.
+    """
+    _counters: Dict[str, Dict[Labels, float]]
+    _histograms: Dict[str, Dict[Labels, Histogram]]
+    _help: Dict[str, str]
+
+    def __init__(self):
+        self._counters = dict()
+        self._histograms = dict()
+        self._help = dict()
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help: str):
+        self._help[name] = help
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def drain(self) -> dict:
+        """
+        a snapshot like to_dict(), and reset in the same step, so nothing recorded in
+        between is lost. Shard workers send these to the main process, see merge()
+        """
+        with self._lock:
+            data = self._snapshot()
+            self._counters.clear()
+            self._histograms.clear()
+        return data
+
+    def merge(self, data: dict):
+        """
+        add a snapshot of another process to these metrics
+        """
+        with self._lock:
+            for name, entries in data['counters'].items():
+                series = self._counters.setdefault(name, {})
+                for entry in entries:
+                    key = _labels(entry['labels'])
+                    series[key] = series.get(key, 0) + entry['value']
+            for name, entries in data['histograms'].items():
+                series = self._histograms.setdefault(name, {})
+                for entry in entries:
+                    key = _labels(entry['labels'])
+                    if key not in series:
+                        series[key] = Histogram(tuple(entry['buckets']))
+                    histogram = series[key]
+                    histogram.counts = [a + b for a, b in zip(histogram.counts, entry['counts'])]
+                    histogram.sum += entry['sum']
+                    histogram.count += entry['count']
+
+    def to_dict(self) -> dict:
+        """
+        a JSON serializable snapshot, as served by the daemon
+        """
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self) -> dict:
+        return {
+            'counters': {
+                name: [{'labels': dict(labels), 'value': value} for labels, value in series.items()]
+                for name, series in self._counters.items()
+            },
+            'histograms': {
+                name: [{'labels': dict(labels), **histogram.to_dict()} for labels, histogram in series.items()]
+                for name, series in self._histograms.items()
+            },
+            'help': dict(self._help),
+        }
+
+    def to_prometheus(self) -> str:
+        return prometheus_text(self.to_dict())
+
+    def write_prometheus(self, path: str):
+        """
+        write the metrics in the Prometheus text format, e.g. for node_exporters textfile collector
+        """
+        # written next to the target and renamed, so scrapers never see half a file
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp, path)
+
+
+def _format_labels(labels: Dict[str, str], **extra) -> str:
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    ) for key, value in labels.items()) + '}'
+
+
+def prometheus_text(data: dict) -> str:
+    """
+    render a Metrics.to_dict() snapshot in the Prometheus text exposition format
+    """
+    lines = []
+    help = data.get('help', {})
+    for name, series in sorted(data['counters'].items()):
+        if name in help:
+            lines.append('# HELP {} {}'.format(name, help[name]))
+        lines.append('# TYPE {} counter'.format(name))
+        for entry in series:
+            lines.append('{}{} {}'.format(name, _format_labels(entry['labels']), entry['value']))
+    for name, series in sorted(data['histograms'].items()):
+        if name in help:
+            lines.append('# HELP {} {}'.format(name, help[name]))
+        lines.append('# TYPE {} histogram'.format(name))
+        for entry in series:
+            cumulative = 0
+            for bound, count in zip([*entry['buckets'], '+Inf'], entry['counts']):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(name, _format_labels(entry['labels'], le=bound), cumulative))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(entry['labels']), entry['sum']))
+            lines.append('{}_count{} {}'.format(name, _format_labels(entry['labels']), entry['count']))
+    return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+METRICS.describe('ptrack_lookup_seconds', "time of a single lookup at a carrier, including parsing")
+METRICS.describe('ptrack_network_seconds', "time of a lookup spent outside of parsing")
+METRICS.describe('ptrack_parse_seconds', "time spent parsing a carrier response")
+METRICS.describe('ptrack_response_bytes_total', "size of the carrier responses handed to the parsers")
+METRICS.describe('ptrack_parse_cache_hits_total', "responses that were unchanged and not parsed again")
+METRICS.describe('ptrack_lookups_total', "packages looked up, by outcome")
+METRICS.describe('ptrack_tick_phase_seconds', "time spent in each phase of a tick")
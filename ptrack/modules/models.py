@@ -1,11 +1,36 @@
+import asyncio
+import dataclasses
+import sys
+import threading
+import time
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from datetime import datetime
 from logging import getLogger, Logger
-from typing import Dict, Protocol
+from typing import Callable, Dict, Protocol, TYPE_CHECKING
 from typing import Optional, Tuple, List
 import enum
 
+from .archive import archive_response
+from .cache import ResponseCache, content_digest
+from .detect import NumberFormat
+from .metrics import METRICS
+
+if TYPE_CHECKING:
+    import requests
+    from .transport import Transport
+
+
+# there can be a lot of these objects around, so they don't get a __dict__ where supported
+_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    """
+    texts and locations repeat a lot between updates and packages, keep only one copy of each
+    """
+    return sys.intern(value) if type(value) is str else value
+
 
 class IsDataclass(Protocol):
     # as already noted in comments, checking for this attribute is currently
@@ -13,12 +38,23 @@ class IsDataclass(Protocol):
     __dataclass_fields__: Dict
 
 
-@dataclass(frozen=True, unsafe_hash=True)
+@dataclass(frozen=True, unsafe_hash=True, **_SLOTS)
 class TrackingIdentifier:
     number: str
     source: Optional[str] = None
     readable_name: Optional[str] = None
 
+    def to_dict(self) -> dict:
+        return {
+            'number': self.number,
+            'source': self.source,
+            'readable_name': self.readable_name,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'TrackingIdentifier':
+        return cls(data['number'], data.get('source'), data.get('readable_name'))
+
 
 class PackageState(enum.Enum):
     ANNOUNCED = 0
@@ -32,14 +68,29 @@ class PackageState(enum.Enum):
     READY_FOR_COLLECTION = 101
 
 
-@dataclass
+@dataclass(**_SLOTS)
 class TrackingUpdateItem:
     text: str
     when: datetime
     where: Optional[str]
 
+    def __post_init__(self):
+        self.text = _intern(self.text)
+        self.where = _intern(self.where)
 
-@dataclass(frozen=True)
+    def to_dict(self) -> dict:
+        return {
+            'text': self.text,
+            'when': self.when.isoformat(),
+            'where': self.where,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'TrackingUpdateItem':
+        return cls(data['text'], datetime.fromisoformat(data['when']), data['where'])
+
+
+@dataclass(frozen=True, **_SLOTS)
 class TrackingState:
     id: TrackingIdentifier
     state: PackageState
@@ -50,7 +101,48 @@ class TrackingState:
     is_delivered: bool
     is_retoure: Optional[bool]
     is_express: Optional[bool]
-    updates: List[TrackingUpdateItem]
+    # any sequence is accepted, but it is always stored as a tuple
+    updates: Tuple[TrackingUpdateItem, ...]
+
+    def __post_init__(self):
+        object.__setattr__(self, 'short_description', _intern(self.short_description))
+        object.__setattr__(self, 'additional_info', _intern(self.additional_info))
+        object.__setattr__(self, 'progress', tuple(self.progress))
+        object.__setattr__(self, 'updates', tuple(self.updates))
+
+    def to_dict(self) -> dict:
+        """
+        A JSON serializable representation of this state, without the id.
+        """
+        return {
+            'state': self.state.name if self.state is not None else None,
+            'short_description': self.short_description,
+            'additional_info': self.additional_info,
+            'last_update': self.last_update.isoformat(),
+            'progress': list(self.progress),
+            'is_delivered': self.is_delivered,
+            'is_retoure': self.is_retoure,
+            'is_express': self.is_express,
+            'updates': [update.to_dict() for update in self.updates],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, id: TrackingIdentifier) -> 'TrackingState':
+        """
+        Inverse of to_dict, attached to the given id.
+        """
+        return cls(
+            id=id,
+            state=PackageState[data['state']] if data['state'] is not None else None,
+            short_description=data['short_description'],
+            additional_info=data['additional_info'],
+            last_update=datetime.fromisoformat(data['last_update']),
+            progress=data['progress'],
+            is_delivered=data['is_delivered'],
+            is_retoure=data['is_retoure'],
+            is_express=data['is_express'],
+            updates=tuple(TrackingUpdateItem.from_dict(update) for update in data['updates']),
+        )
 
     def pretty_print(self):
         return "{}: {}\n{}{}{}".format(
@@ -66,20 +158,46 @@ class TrackingState:
             return ""
         return "Updates:\n" + '\n\n'.join(
             "  {:%Y-%m-%d %H:%M}: {}\n{}{}".format(
-                update.when, update.where if update.where else '?',
+                update.when.astimezone(), update.where if update.where else '?',
                 ' ' * 20, update.text,
             ) for update in self.updates
         )
 
 
+# parse time of the lookup running on this thread, to tell it apart from network time
+_lookup_timing = threading.local()
+
+
 class TrackingSupplier(ABC):
     name: str
     config: IsDataclass
     logger: Logger
+    response_cache: ResponseCache
+
+    # how many ids get_details_for_many accepts in a single call. Suppliers whose
+    # carrier can answer for several tracking numbers in one request raise this.
+    batch_size: int = 1
 
-    def __init__(self, config: IsDataclass):
+    # the formats of this carriers tracking numbers, used to tell the carrier of
+    # packages listed without one, see ptrack.modules.detect
+    number_formats: Tuple[NumberFormat, ...] = ()
+
+    def __init__(self, config: IsDataclass, http: Optional['Transport'] = None):
         self.config = config
         self.logger = getLogger(".".join(__name__.split('.')[:-1] + [self.__class__.__name__]))
+        self._http = http
+        self.response_cache = ResponseCache()
+
+    @property
+    def http(self) -> 'Transport':
+        """
+        The pooled HTTP transport all requests of this supplier should go through.
+        """
+        if self._http is None:
+            # imported here so models stays importable without pulling in requests
+            from .transport import shared_transport
+            self._http = shared_transport()
+        return self._http
 
     @abstractmethod
     def get_details_for(self, details: TrackingIdentifier) -> Optional[TrackingState]:
@@ -89,3 +207,138 @@ class TrackingSupplier(ABC):
         :param details: the tracking details of the package
         """
         pass
+
+    async def get_details_for_async(self, details: TrackingIdentifier) -> Optional[TrackingState]:
+        """
+        Asynchronous counterpart to get_details_for.
+
+        The default implementation runs the synchronous get_details_for in the
+        event loop's default executor, so suppliers only need to override this
+        if they can do their I/O natively in asyncio.
+
+        :param details: the tracking details of the package
+        """
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(None, self._measured, [details], lambda: {
+            details: self.get_details_for(details)
+        })
+        return results[details]
+
+    def get_details_for_many(self, ids: List[TrackingIdentifier]) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        """
+        Get the state of multiple packages at once.
+
+        The default implementation looks them up one by one. Suppliers that can
+        batch requests should override this and set batch_size accordingly.
+
+        :param ids: the tracking details of the packages, at most batch_size of them
+        """
+        return {id: self.get_details_for(id) for id in ids}
+
+    def parse_raw(self, raw, ids: List[TrackingIdentifier]) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        """
+        Parse a response into the states of ids, without any network access.
+
+        This is what suppliers hand to _parse_cached, so responses kept in a
+        ResponseArchive can be parsed again with the current parser.
+
+        Suppliers that don't implement this don't have their responses archived,
+        see parses_raw.
+
+        :param raw: the response, exactly as it was passed to _parse_cached
+        :param ids: the packages the response is for
+        """
+        raise NotImplementedError("{} can't parse archived responses".format(self.__class__.__name__))
+
+    @classmethod
+    def parses_raw(cls) -> bool:
+        """
+        whether the supplier implements parse_raw, so its responses can be parsed again
+        """
+        return cls.parse_raw is not TrackingSupplier.parse_raw
+
+    async def get_details_for_many_async(self, ids: List[TrackingIdentifier]) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        """
+        Asynchronous counterpart to get_details_for_many.
+
+        :param ids: the tracking details of the packages, at most batch_size of them
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._measured, ids, lambda: self.get_details_for_many(ids))
+
+    def _measured(self, ids: List[TrackingIdentifier],
+                  lookup: Callable[[], Dict[TrackingIdentifier, Optional[TrackingState]]]) \
+            -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        """
+        run lookup and record its latency, split into network and parse time, and its outcome
+        """
+        _lookup_timing.parse_seconds = 0
+        start = time.perf_counter()
+        try:
+            results = lookup()
+        except Exception:
+            METRICS.inc('ptrack_lookups_total', len(ids), carrier=self.name, outcome='error')
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            METRICS.observe('ptrack_lookup_seconds', elapsed, carrier=self.name)
+            METRICS.observe('ptrack_network_seconds', max(elapsed - _lookup_timing.parse_seconds, 0), carrier=self.name)
+        found = sum(1 for state in results.values() if state is not None)
+        METRICS.inc('ptrack_lookups_total', found, carrier=self.name, outcome='found')
+        METRICS.inc('ptrack_lookups_total', len(ids) - found, carrier=self.name, outcome='not_found')
+        return results
+
+    def _parse_cached(self, key: str, raw, ids: List[TrackingIdentifier],
+                      parse: Callable[[], Dict[TrackingIdentifier, Optional[TrackingState]]],
+                      resp: Optional['requests.Response'] = None) -> Dict[TrackingIdentifier, Optional[TrackingState]]:
+        """
+        Run parse(), unless the response for key is the same as last time.
+
+        In that case the states parsed last time are returned as they are, so callers
+        can tell by identity that nothing changed. A response counts as the same if
+        raw hashes to the same digest, or if the carrier answered 304 Not Modified to
+        a request made with response_cache.validators(key).
+
+        :param key: identifies the request, usually the tracking number(s) it was for
+        :param raw: the response body, or the part of it parse() depends on
+        :param ids: the packages the response is for
+        :param parse: parses raw into states for ids
+        :param resp: the response, to pick up ETag and Last-Modified
+        """
+        not_modified = resp is not None and resp.status_code == 304
+        if not not_modified:
+            METRICS.inc('ptrack_response_bytes_total', len(raw), carrier=self.name)
+        digest = None if not_modified else content_digest(raw)
+        cached = self.response_cache.get(key, digest)
+        if cached is not None and all(id.number in cached for id in ids):
+            METRICS.inc('ptrack_parse_cache_hits_total', carrier=self.name)
+            results = {id: _with_id(cached[id.number], id) for id in ids}
+            renamed = {id.number: state for id, state in results.items() if state is not cached[id.number]}
+            if renamed:
+                # so the next hit returns the very same copies, and callers see nothing changed
+                self.response_cache.update(key, renamed)
+            return results
+        if not_modified:
+            self.logger.error("Got 304 Not Modified for {}, but nothing cached".format(key))
+            return {id: None for id in ids}
+        if self.parses_raw():
+            archive_response(self.name, key, ids, raw, time.time(), digest)
+
+        start = time.perf_counter()
+        results = parse()
+        elapsed = time.perf_counter() - start
+        METRICS.observe('ptrack_parse_seconds', elapsed, carrier=self.name)
+        _lookup_timing.parse_seconds = getattr(_lookup_timing, 'parse_seconds', 0) + elapsed
+
+        self.response_cache.put(
+            key, digest, {id.number: state for id, state in results.items()},
+            etag=resp.headers.get('ETag') if resp is not None else None,
+            last_modified=resp.headers.get('Last-Modified') if resp is not None else None,
+        )
+        return results
+
+
+def _with_id(state: Optional[TrackingState], id: TrackingIdentifier) -> Optional[TrackingState]:
+    if state is None or state.id == id:
+        return state
+    return dataclasses.replace(state, id=id)
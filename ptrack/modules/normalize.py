@@ -0,0 +1,82 @@
+"""
+Normalization of the dates and locations carriers report.
+
+Every poll parses a packages whole history again, so the same few strings are
+normalized over and over. The results are kept in bounded LRU caches, and the
+formats carriers actually use are recognized without going through dateutil.
+"""
+import re
+import sys
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional
+
+# dates and locations remembered, a few thousand packages with a long history fit in easily
+DATE_CACHE_SIZE = 16384
+LOCATION_CACHE_SIZE = 4096
+
+# the "last update" of packages without any
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# formats carriers are known to use, that fromisoformat doesn't understand
+_FORMATS = (
+    # GLS, the date and time columns of the tracking table
+    (re.compile(r'\d{1,2}\.\d{1,2}\.\d{4} \d{1,2}:\d{2}:\d{2}'), '%d.%m.%Y %H:%M:%S'),
+    (re.compile(r'\d{1,2}\.\d{1,2}\.\d{4} \d{1,2}:\d{2}'), '%d.%m.%Y %H:%M'),
+    # GlobalPost
+    (re.compile(r'[A-Za-z]{3} \d{1,2}, \d{4} - \d{1,2}:\d{2} [AaPp][Mm]'), '%b %d, %Y - %I:%M %p'),
+)
+
+# fromisoformat only accepts a Z suffix since python 3.11
+_ISO_Z = sys.version_info < (3, 11)
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_datetime(text: str, dayfirst: bool = False) -> datetime:
+    """
+    Parse a date and time as reported by a carrier into a timezone aware datetime.
+
+    Times without an offset are taken to be in local time.
+
+    :param dayfirst: how to read ambiguous dates like 01.02.2022 that aren't in a known format
+    :raises ValueError: if text isn't a date at all
+    """
+    text = text.strip()
+    dt = None
+    if text[4:5] == '-' and text[:4].isdigit():
+        try:
+            dt = datetime.fromisoformat(text[:-1] + '+00:00' if _ISO_Z and text.endswith('Z') else text)
+        except ValueError:
+            pass
+    if dt is None:
+        for pattern, fmt in _FORMATS:
+            if pattern.fullmatch(text):
+                dt = datetime.strptime(text, fmt)
+                break
+        else:
+            # imported here, it's slow to import and only needed for formats nobody uses (yet)
+            from dateutil.parser import parse, ParserError
+            try:
+                dt = parse(text, dayfirst=dayfirst)
+            except (ParserError, OverflowError) as e:
+                raise ValueError("not a date: {!r} ({})".format(text, e))
+    if dt.tzinfo is None:
+        dt = dt.astimezone()
+    return dt
+
+
+@lru_cache(maxsize=LOCATION_CACHE_SIZE)
+def location(*parts: Optional[str]) -> Optional[str]:
+    """
+    Join the parts of a location (e.g. city, province and country) that are known,
+    or None if none of them are.
+
+    The result is interned, so all updates from one place share the string.
+    """
+    joined = ", ".join(part.strip() for part in parts if part and part.strip())
+    return sys.intern(joined) if joined else None
+
+
+def clear_caches():
+    parse_datetime.cache_clear()
+    location.cache_clear()
@@ -0,0 +1,152 @@
+import importlib
+import threading
+from logging import getLogger
+from typing import Dict, Iterator, Mapping, Optional, Tuple, Type, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .models import TrackingSupplier
+
+logger = getLogger(__name__)
+
+# entry point group third-party carriers register under. The entry point name is the
+# source used in tracking files, its object a (supplier class, config class) tuple:
+#
+#   [project.entry-points."ptrack.carriers"]
+#   mycarrier = "ptrack_mycarrier:CARRIER"
+ENTRY_POINT_GROUP = 'ptrack.carriers'
+
+# source -> (module, supplier class, config class) of the carriers shipped with ptrack
+BUILTIN_CARRIERS: Dict[str, Tuple[str, str, str]] = {
+    'dhl': ('ptrack.modules.dhl_de', 'DHL_DE', 'DHL_DE_Config'),
+    'asendia': ('ptrack.modules.asendia', 'AsendiaTracking', 'AsendiaConfig'),
+    'globalpost': ('ptrack.modules.globalpost', 'GlobalPostTracking', 'GlobalPostSettings'),
+    'gls': ('ptrack.modules.gls', 'GLS', 'GLS_Config'),
+}
+
+Carrier = Tuple[Type['TrackingSupplier'], type]
+
+
+def _entry_points() -> list:
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        # python 3.7, no plugins without importlib_metadata
+        return []
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return list(eps.select(group=ENTRY_POINT_GROUP))
+    return list(eps.get(ENTRY_POINT_GROUP, []))
+
+
+class CarrierRegistry(Mapping[str, Carrier]):
+    """
+    Maps a source name to its (supplier class, config class), importing the carriers
+    module only when it is first looked up.
+
+    Besides the builtin carriers, carriers registered by other packages under the
+    ptrack.carriers entry point group are found. Entry points are only scanned when a
+    name isn't a builtin carrier, or when the whole registry is iterated.
+    """
+    _loaded: Dict[str, Carrier]
+    _plugins: Optional[Dict[str, object]]
+    # the carriers added with register()
+    _registered: Dict[str, Carrier]
+
+    def __init__(self):
+        self._loaded = dict()
+        self._registered = dict()
+        self._plugins = None
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> Carrier:
+        with self._lock:
+            if name not in self._loaded:
+                self._loaded[name] = self._load(name)
+            return self._loaded[name]
+
+    def _load(self, name: str) -> Carrier:
+        if name in BUILTIN_CARRIERS:
+            module, cls, config_cls = BUILTIN_CARRIERS[name]
+            module = importlib.import_module(module)
+            return getattr(module, cls), getattr(module, config_cls)
+        plugin = self._plugin_entry_points().get(name)
+        if plugin is None:
+            raise KeyError(name)
+        cls, config_cls = plugin.load()
+        return cls, config_cls
+
+    def _plugin_entry_points(self) -> Dict[str, object]:
+        if self._plugins is None:
+            self._plugins = dict()
+            for ep in _entry_points():
+                if ep.name in BUILTIN_CARRIERS:
+                    logger.warning("Ignoring carrier plugin {} ({}), it shadows a builtin carrier".format(ep.name, ep.value))
+                    continue
+                self._plugins[ep.name] = ep
+        return self._plugins
+
+    def __contains__(self, name) -> bool:
+        return name in BUILTIN_CARRIERS or name in self._loaded or name in self._plugin_entry_points()
+
+    def __iter__(self) -> Iterator[str]:
+        # builtins first, then plugins, then carriers registered at runtime
+        return iter(dict.fromkeys([*BUILTIN_CARRIERS, *self._plugin_entry_points(), *self._loaded]))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def register(self, name: str, cls: Type['TrackingSupplier'], config_cls: type):
+        """
+        add a carrier at runtime, e.g. from a script that embeds ptrack
+        """
+        with self._lock:
+            self._loaded[name] = self._registered[name] = (cls, config_cls)
+
+    def registered(self) -> Dict[str, Carrier]:
+        """
+        the carriers added with register(), which other processes don't know about
+        """
+        with self._lock:
+            return dict(self._registered)
+
+
+class SupplierPool(Mapping[str, 'TrackingSupplier']):
+    """
+    One supplier instance per source, created with its default config the first time
+    a package of that source is looked up.
+    """
+    registry: CarrierRegistry
+
+    _suppliers: Dict[str, 'TrackingSupplier']
+
+    def __init__(self, registry: CarrierRegistry):
+        self.registry = registry
+        self._suppliers = dict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, source: str) -> 'TrackingSupplier':
+        with self._lock:
+            if source not in self._suppliers:
+                cls, config_cls = self.registry[source]
+                logger.debug("Loaded carrier {}".format(source))
+                self._suppliers[source] = cls(config_cls())
+            return self._suppliers[source]
+
+    def __contains__(self, source) -> bool:
+        return source in self._suppliers or source in self.registry
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.registry)
+
+    def __len__(self) -> int:
+        return len(self.registry)
+
+    def loaded(self) -> Dict[str, 'TrackingSupplier']:
+        """
+        the suppliers that were instantiated so far
+        """
+        with self._lock:
+            return dict(self._suppliers)
+
+
+ALL_MODULES = CarrierRegistry()
@@ -0,0 +1,145 @@
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple, TYPE_CHECKING
+from urllib.parse import urlsplit
+
+if TYPE_CHECKING:
+    import requests
+
+
+@dataclass
+class TransportConfig:
+    # default timeout in seconds for connecting and for reading a response
+    timeout: float = 10
+    # how often a request is retried on connection errors or retry_statuses
+    retries: int = 3
+    # the n-th retry waits backoff_factor * 2^(n-1) seconds
+    backoff_factor: float = 0.5
+    retry_statuses: Tuple[int, ...] = (429, 500, 502, 503, 504)
+    # number of keep-alive connections kept open per host
+    pool_size: int = 16
+
+
+class CarrierUnavailable(OSError):
+    """
+    The carrier answered with one of the retry_statuses even after all retries.
+    """
+    status_code: int
+    # seconds the carrier asked us to wait, if it said so
+    retry_after: Optional[float]
+
+    def __init__(self, url: str, status_code: int, retry_after: Optional[float] = None):
+        super().__init__("{} answered {}".format(urlsplit(url).netloc, status_code))
+        self.url = url
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        # OSError would pickle only the message, these cross process boundaries in sharded mode
+        return type(self), (self.url, self.status_code, self.retry_after)
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    # the HTTP date form isn't worth the trouble, nobody we talk to sends it
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class Transport:
+    """
+    The HTTP client shared by all suppliers.
+
+    It keeps one pooled requests.Session per host, so connections (and their TLS sessions)
+    are kept alive and reused across lookups instead of being set up for every request.
+    Responses are requested compressed and failed requests are retried with backoff.
+    """
+    config: TransportConfig
+
+    _sessions: Dict[str, 'requests.Session']
+
+    def __init__(self, config: Optional[TransportConfig] = None):
+        self.config = config or TransportConfig()
+        self._sessions = dict()
+        self._lock = threading.Lock()
+
+    def session_for(self, url: str) -> 'requests.Session':
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._sessions:
+                self._sessions[host] = self._new_session()
+            return self._sessions[host]
+
+    def get(self, url: str, timeout: Optional[float] = None, **kwargs) -> 'requests.Response':
+        """
+        Same as requests.get, but on the pooled session of the urls host.
+
+        Connection errors and timeouts are raised as requests.RequestException once
+        all retries are used up, retry_statuses as CarrierUnavailable. Both are OSErrors.
+        Other error statuses are returned as they are.
+        """
+        resp = self.session_for(url).get(url, timeout=timeout or self.config.timeout, **kwargs)
+        if resp.status_code in self.config.retry_statuses:
+            resp.close()
+            raise CarrierUnavailable(url, resp.status_code, _retry_after(resp.headers.get('Retry-After')))
+        return resp
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def _new_session(self) -> 'requests.Session':
+        # requests is only imported here, so the CLI can start without it
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util import Retry, make_headers
+
+        retry = Retry(
+            total=self.config.retries,
+            backoff_factor=self.config.backoff_factor,
+            status_forcelist=self.config.retry_statuses,
+            allowed_methods=frozenset({'GET', 'HEAD'}),
+            # a Retry-After of an hour would block the lookup for an hour. The
+            # refresh engine backs off from the carrier as a whole instead.
+            respect_retry_after_header=False,
+            # hand the last response to the supplier instead of raising
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.config.pool_size, max_retries=retry)
+
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        # gzip and deflate, plus br if brotli is installed
+        session.headers.update(make_headers(accept_encoding=True))
+        return session
+
+
+_shared_transport: Optional[Transport] = None
+_shared_transport_lock = threading.Lock()
+
+
+def shared_transport() -> Transport:
+    """
+    The transport used by suppliers that were not given one explicitly.
+    """
+    global _shared_transport
+    with _shared_transport_lock:
+        if _shared_transport is None:
+            _shared_transport = Transport()
+        return _shared_transport
+
+
+def configure_shared_transport(config: TransportConfig) -> Transport:
+    """
+    Replace the shared transport with one using the given config.
+    """
+    global _shared_transport
+    with _shared_transport_lock:
+        if _shared_transport is not None:
+            _shared_transport.close()
+        _shared_transport = Transport(config)
+        return _shared_transport